@@ -0,0 +1,273 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Measures the speed of the extruder.
+Times each stage of the pipeline on a synthetic green screen photo,
+and reports the times, peak memory of each stage and triangles per second,
+optionally as JSON to compare commits.
+Requires NumPy.
+"""
+from PIL import Image
+import extruder
+import stl_writer
+from mesh import Mesh
+import argparse
+import json
+import numpy
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Colors of the synthetic photo
+BACKGROUND_COLOR = (40, 180, 60)
+HEAD_COLOR = (220, 170, 140)
+BODY_COLOR = (60, 60, 140)
+
+def main():
+	"""
+	Program bootstart function
+	"""
+	parser = argparse.ArgumentParser(description='Measures the speed of each stage of the extruder on a synthetic green screen photo.')
+	parser.add_argument('--width', type=int, default=2000, help='width of the photo in pixels')
+	parser.add_argument('--height', type=int, default=1500, help='height of the photo in pixels')
+	parser.add_argument('--noise', type=float, default=8, help='standard deviation of the noise added to the photo')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the noise')
+	parser.add_argument('--size', type=int, default=extruder.PROFILE_AREA_WIDTH, help='width of the shape in pixels')
+	parser.add_argument('--repeat', type=int, default=3, help='number of runs of each stage, the fastest is kept')
+	parser.add_argument('--json', metavar='FILE', help='write the report as JSON to FILE, - for the standard output')
+	parser.add_argument('--micro', action='store_true', help='compare the implementations of the STL writer and of the vertex generation instead')
+	args = parser.parse_args()
+	if args.micro:
+		microMain(args.size)
+		return
+	report = benchmarkPipeline(args.width, args.height, args.noise, args.seed, args.size, args.repeat)
+	if args.json == '-':
+		json.dump(report, sys.stdout, indent=2, sort_keys=True)
+		print("")
+		return
+	if args.json:
+		with open(args.json, 'w') as fp:
+			json.dump(report, fp, indent=2, sort_keys=True)
+	print("Pipeline, " + str(args.width) + "x" + str(args.height) + " pixels photo, " + str(args.size) + " pixels shape:")
+	for stage in report['stages']:
+		line = "  %-20s %8.4f s %8d MB %+8d MB" % (stage['name'], stage['seconds'], stage['peakMemory'] >> 20, stage['memoryIncrease'] >> 20)
+		if 'trianglesPerSecond' in stage:
+			line+= " %10d triangles/s" % stage['trianglesPerSecond']
+		print(line)
+
+def microMain(size):
+	"""
+	Compares the implementations of the STL writer and of the vertex generation
+	"""
+	img = extruder.addFrame(squareImage(size), 15)
+	faces = extruder.extrudeFaces(img, extruder.SHAPE_UNIT, extruder.BASE_Z, extruder.SHAPE_Z)
+	print("ASCII STL writer, " + str(size) + "x" + str(size) + " pixels:")
+	for name, rate in benchmarkASCIIWriter(faces):
+		print("  " + name + ": " + str(int(rate)) + " triangles/s")
+	print("Vertex generation, 500x500 pixels:")
+	results = benchmarkVertices(squareImage(500))
+	for name, duration in results:
+		print("  " + name + ": %.4f s (%.1f times faster)" % (duration, results[0][1] / duration))
+
+def benchmarkPipeline(width, height, noise, seed, size, repeat):
+	"""
+	Times each stage of the extruder on a synthetic photo of width x height
+	pixels (see greenScreenImage) saved as PNG, with the current settings.
+	Each stage is run repeat times and the fastest run is kept,
+	then once more in a child process to measure its memory (see stageMemory).
+	Returns the report as a dict that can be written as JSON
+	"""
+	threshold = extruder.COLOR_THRESHOLD
+	unit, baseZ, fullZ = extruder.SHAPE_UNIT, extruder.BASE_Z, extruder.SHAPE_Z
+	stages = []
+	def stage(name, function, triangles=None):
+		durations = []
+		for i in range(0, repeat):
+			start = time.time()
+			result = function()
+			durations.append(time.time() - start)
+		peak, increase = stageMemory(function)
+		stages.append({'name': name, 'seconds': min(durations), 'peakMemory': peak, 'memoryIncrease': increase})
+		if triangles is not None:
+			stages[-1]['triangles'] = triangles
+			stages[-1]['trianglesPerSecond'] = triangles / max(min(durations), 1e-9)
+		return result
+	fd, path = tempfile.mkstemp(suffix='.png')
+	os.close(fd)
+	try:
+		greenScreenImage(width, height, noise, seed).save(path)
+		data = stage('decode', lambda: numpy.asarray(Image.open(path).convert('RGB')))
+	finally:
+		os.remove(path)
+	def background():
+		histogram = None
+		if extruder.BACKGROUND_ESTIMATOR == 'histogram':
+			histogram = extruder.colorHistogram(data, *extruder.histogramSettings())
+		return extruder.findBackground(data, threshold, histogram=histogram)
+	dominantColor, dominantColorRate, mask = stage('background', background)
+	box = stage('bounding box', lambda: extruder.findBoundingBox(data, dominantColor, threshold, mask=mask))
+	shape = stage('downscale', lambda: extruder.shapeImage(data, box, size, dominantColor, threshold))
+	framed = stage('addFrame', lambda: extruder.addFrame(shape, int(fullZ - baseZ)))
+	mesh = extruder.extrude(framed, unit, baseZ, fullZ)
+	stage('extrude', lambda: extruder.extrude(framed, unit, baseZ, fullZ), len(mesh))
+	stage('extrude (streamed)', lambda: sum(len(chunk) for chunk in extruder.extrudeChunks(framed, unit, baseZ, fullZ)),
+		sum(len(chunk) for chunk in extruder.extrudeChunks(framed, unit, baseZ, fullZ)))
+	for stlFormat in ('ascii', 'binary'):
+		def write():
+			with open(os.devnull, 'wb') as fp:
+				writer = stl_writer.WRITERS[stlFormat](fp)
+				writer.add_mesh(mesh)
+				writer.close()
+		stage(stlFormat + ' writer', write, len(mesh))
+	return {
+		'commit': gitCommit(),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'settings': {
+			'width': width, 'height': height, 'noise': noise, 'seed': seed, 'size': size, 'repeat': repeat,
+			'backgroundEstimator': extruder.BACKGROUND_ESTIMATOR, 'boundingBoxSearch': extruder.BOUNDING_BOX_SEARCH,
+			'topMeshing': extruder.TOP_MESHING},
+		'stages': stages}
+
+def greenScreenImage(width, height, noise=0, seed=0):
+	"""
+	Returns a synthetic photo of a head and shoulders profile
+	in front of a green background, with a gaussian noise
+	of standard deviation noise (fixed by seed)
+	"""
+	y, x = numpy.ogrid[0:height, 0:width]
+	data = numpy.empty((height, width, 3), numpy.uint8)
+	data[:, :] = BACKGROUND_COLOR
+	data[((x - 0.5*width) / (0.12*width))**2 + ((y - 0.35*height) / (0.18*height))**2 < 1] = HEAD_COLOR
+	data[((x - 0.5*width) / (0.3*width))**2 + ((y - 1.0*height) / (0.45*height))**2 < 1] = BODY_COLOR
+	if noise > 0:
+		# By blocks of rows to limit the memory used
+		random = numpy.random.RandomState(seed)
+		step = max((1 << 20) // width, 1)
+		for start in range(0, height, step):
+			block = data[start:start+step]
+			block[...] = numpy.clip(block + random.normal(0, noise, block.shape), 0, 255)
+	return Image.fromarray(data, 'RGB')
+
+def stageMemory(function):
+	"""
+	Calls function in a forked process, whose peak memory starts from
+	the current memory instead of the peak of this process.
+	Returns (peak resident memory of the call, its increase) in bytes
+	"""
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read)
+		try:
+			start = peakMemory()
+			function()
+			os.write(write, json.dumps([peakMemory(), peakMemory() - start]).encode('ascii'))
+		finally:
+			os._exit(0)
+	os.close(write)
+	with os.fdopen(read, 'rb') as fp:
+		result = fp.read()
+	os.waitpid(pid, 0)
+	if not result:
+		raise RuntimeError('the memory of the stage could not be measured')
+	return tuple(json.loads(result.decode('ascii')))
+
+def peakMemory():
+	"""
+	Returns the peak resident memory of the process in bytes
+	"""
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return peak
+	return peak * 1024
+
+def gitCommit():
+	"""
+	Returns the current git commit of the extruder, or None
+	"""
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'w')).strip().decode('ascii')
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def squareImage(size):
+	"""
+	Returns a black size x size image with a white disc in the middle
+	"""
+	y, x = numpy.mgrid[0:size, 0:size]
+	disc = (x - size / 2.0)**2 + (y - size / 2.0)**2 < (size / 3.0)**2
+	data = numpy.zeros((size, size, 3), numpy.uint8)
+	data[disc] = 255
+	return Image.fromarray(data, 'RGB')
+
+def benchmarkASCIIWriter(faces):
+	"""
+	Writes the quad faces with the ASCII STL writer, one face at a time
+	(previous writer), in batches, and in batches from a Mesh.
+	Returns a list of (name, triangles per second)
+	"""
+	triangles = 2 * len(faces)
+	array = numpy.asarray(faces)
+	mesh = Mesh(array.reshape(-1, 3), numpy.arange(4 * len(faces)).reshape(-1, 4)[:, [0, 1, 2, 2, 3, 0]])
+	def oneByOne(writer):
+		for face in faces:
+			writer.add_face(face)
+	def batched(writer):
+		writer.add_faces(faces)
+	def batchedMesh(writer):
+		writer.add_mesh(mesh)
+	results = []
+	for name, write in (('one by one', oneByOne), ('batched', batched), ('batched from a mesh', batchedMesh)):
+		with open(os.devnull, 'wb') as fp:
+			start = time.time()
+			writer = stl_writer.ASCIISTLWriter(fp)
+			write(writer)
+			writer.close()
+			duration = time.time() - start
+		results.append((name, triangles / duration))
+	return results
+
+def benchmarkVertices(img):
+	"""
+	Generates the vertices of the top quads of an image by computing
+	each point from its pixel (previous extrudeFaces), with coordinate
+	and height lookup tables (extrudeFaces), and with index gathers
+	in the coordinate arrays (extrude).
+	Returns a list of (name, duration in seconds)
+	"""
+	width, height = img.size
+	unit, baseZ, fullZ = extruder.SHAPE_UNIT, extruder.BASE_Z, extruder.SHAPE_Z
+	pix = img.load()
+	def perPoint():
+		def topPoint(x, y):
+			z = baseZ
+			if pix[x, y][0] != 0:
+				z = fullZ
+			return ((x-width/2)*unit, (height/2-y)*unit, z*unit)
+		return [(topPoint(x, y), topPoint(x+1, y), topPoint(x+1, y+1), topPoint(x, y+1))
+			for x in range(0, width-1) for y in range(0, height-1)]
+	def lookup():
+		xs = [(x-width/2)*unit for x in range(0, width)]
+		ys = [(height/2-y)*unit for y in range(0, height)]
+		zs = (baseZ*unit, fullZ*unit)
+		def topPoint(x, y):
+			return (xs[x], ys[y], zs[pix[x, y][0] != 0])
+		return [(topPoint(x, y), topPoint(x+1, y), topPoint(x+1, y+1), topPoint(x, y+1))
+			for x in range(0, width-1) for y in range(0, height-1)]
+	def gather():
+		mesh = extruder.extrude(img, unit, baseZ, fullZ, 'grid')
+		return mesh.vertices[mesh.triangles]
+	results = []
+	for name, generate in (('point by point', perPoint), ('lookup tables', lookup), ('index gathers', gather)):
+		start = time.time()
+		generate()
+		results.append((name, time.time() - start))
+	return results
+
+if __name__ == '__main__':
+	main()
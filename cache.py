@@ -0,0 +1,224 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Caches for the intermediate results of the image analysis:
+in-process (LRUCache) and on disk, shared between processes (DiskCache).
+Entries are evicted in least recently used order
+when the total size goes over a byte limit.
+"""
+from collections import OrderedDict
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Temporary entries older than this (in seconds) are left over
+# by crashed processes and can be removed
+STALE_TEMPORARY_AGE = 3600
+
+class LRUCache:
+	"""
+	Least recently used cache bounded by the size of its values in bytes
+	"""
+	def __init__(self, maxBytes):
+		"""
+		Creates an empty cache that holds at most maxBytes bytes
+		"""
+		self.maxBytes = maxBytes
+		self.__entries = OrderedDict()
+		self.__bytes = 0
+		self.__lock = threading.Lock()
+
+	def get(self, key, default=None):
+		"""
+		Returns the value stored for key, or default.
+		The entry becomes the most recently used one.
+		"""
+		with self.__lock:
+			if key not in self.__entries:
+				return default
+			value, size = self.__entries.pop(key)
+			self.__entries[key] = (value, size)
+			return value
+
+	def put(self, key, value, size=None):
+		"""
+		Stores a value for key, evicting the least recently used entries
+		if needed. size is computed with valueSize if not given.
+		Values bigger than the whole cache are not stored.
+		"""
+		if size is None:
+			size = valueSize(value)
+		with self.__lock:
+			if key in self.__entries:
+				self.__bytes-= self.__entries.pop(key)[1]
+			if size > self.maxBytes:
+				return
+			self.__entries[key] = (value, size)
+			self.__bytes+= size
+			while self.__bytes > self.maxBytes:
+				oldKey, (oldValue, oldSize) = self.__entries.popitem(last=False)
+				self.__bytes-= oldSize
+
+	def clear(self):
+		"""
+		Removes all the entries
+		"""
+		with self.__lock:
+			self.__entries.clear()
+			self.__bytes = 0
+
+	def __len__(self):
+		return len(self.__entries)
+
+	@property
+	def size(self):
+		"""
+		Current size of the stored values in bytes
+		"""
+		return self.__bytes
+
+def valueSize(value):
+	"""
+	Estimates the memory used by a value in bytes.
+	Counts the buffers of arrays (nbytes) and PIL images
+	in nested tuples and lists, and a small fixed size for other values.
+	"""
+	if hasattr(value, 'nbytes'):
+		return int(value.nbytes)
+	if hasattr(value, 'getbands'):
+		width, height = value.size
+		return width * height * imagePixelSize(value)
+	if isinstance(value, (tuple, list)):
+		return 64 + sum(valueSize(item) for item in value)
+	return 64
+
+def imagePixelSize(img):
+	"""
+	Bytes used by a pixel of a PIL image: pixels of several bands
+	are stored on 4 bytes, as 32-bit integers and floats
+	"""
+	if img.mode.startswith('I;16'):
+		return 2
+	if img.mode in ('I', 'F') or len(img.getbands()) > 1:
+		return 4
+	return 1
+
+class DiskCache:
+	"""
+	Cache of named arrays stored in a directory, shared between
+	processes and runs. Each entry is a directory of .npy files,
+	memory-mapped when read (requires NumPy).
+	Entries are written in a temporary directory and then renamed,
+	and removed the same way, so that other processes never see
+	a partial entry.
+	"""
+	def __init__(self, directory, maxBytes):
+		"""
+		Opens (and creates if needed) the cache in directory,
+		holding at most maxBytes bytes
+		"""
+		self.directory = directory
+		self.maxBytes = maxBytes
+		try:
+			os.makedirs(directory)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+
+	def get(self, key):
+		"""
+		Returns the entry stored for key as a dict name: read-only array,
+		or None if there is no such entry
+		"""
+		path = self.__path(key)
+		entry = {}
+		try:
+			for fileName in os.listdir(path):
+				if fileName.endswith('.npy'):
+					entry[fileName[:-4]] = numpy.load(os.path.join(path, fileName), mmap_mode='r')
+			# Mark the entry as recently used
+			os.utime(path, None)
+		except (OSError, IOError, ValueError):
+			# Missing, or removed by another process meanwhile
+			return None
+		return entry
+
+	def put(self, key, entry):
+		"""
+		Stores an entry (dict name: array) for key,
+		then evicts the least recently used entries if needed
+		"""
+		path = self.__path(key)
+		if os.path.isdir(path):
+			return
+		tempPath = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+		try:
+			for name, value in entry.items():
+				numpy.save(os.path.join(tempPath, name + '.npy'), numpy.asarray(value))
+			os.rename(tempPath, path)
+		except OSError:
+			# Another process stored the same entry meanwhile
+			shutil.rmtree(tempPath, True)
+			return
+		self.evict()
+
+	def evict(self):
+		"""
+		Removes the least recently used entries
+		until the cache holds at most maxBytes bytes
+		"""
+		entries = []
+		total = 0
+		now = time.time()
+		for name in os.listdir(self.directory):
+			path = os.path.join(self.directory, name)
+			try:
+				if name.startswith('.'):
+					# Temporary entry, removed if left over by a crashed process
+					if now - os.path.getmtime(path) > STALE_TEMPORARY_AGE:
+						shutil.rmtree(path, True)
+					continue
+				size = sum(os.path.getsize(os.path.join(path, fileName)) for fileName in os.listdir(path))
+				entries.append((os.path.getmtime(path), size, path))
+			except OSError:
+				continue
+			total+= size
+		entries.sort()
+		for mtime, size, path in entries:
+			if total <= self.maxBytes:
+				break
+			# Rename first so that no process reads a partially removed entry
+			trashPath = os.path.join(self.directory, '.del-' + os.path.basename(path) + '-' + str(os.getpid()))
+			try:
+				os.rename(path, trashPath)
+			except OSError:
+				continue
+			shutil.rmtree(trashPath, True)
+			total-= size
+
+	def __path(self, key):
+		"""
+		Directory of the entry for key
+		"""
+		return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+def fileHash(filename):
+	"""
+	Returns the SHA-1 hash of the content of a file
+	"""
+	digest = hashlib.sha1()
+	with open(filename, 'rb') as fp:
+		while True:
+			chunk = fp.read(1 << 20)
+			if not chunk:
+				break
+			digest.update(chunk)
+	return digest.hexdigest()
@@ -7,9 +7,23 @@ Other colors are higher.
 Requires the Python PIL library (http://www.pythonware.com/products/pil/)
 """
 from PIL import Image
-from stl_writer import ASCIISTLWriter as STLWriter
+from stl_writer import WRITERS as STL_WRITERS
+from mesh import heightmapMesh, heightmapTriangles
+from cache import LRUCache, DiskCache, fileHash, valueSize
+from tiles import TilePool
+import argparse
+import contextlib
+import glob
 import math
+import multiprocessing
+import os
 import sys
+import threading
+import time
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 # Threshold to determine if a color is similar to another
 # To increase if some background is detected as part of the profile
@@ -33,29 +47,154 @@ BASE_Z = 5
 # Shape altitude in pixels
 SHAPE_Z = 20
 
+# Format of the STL files: 'binary' (about 5 times smaller) or 'ascii'
+STL_FORMAT = 'binary'
+
+# Meshing of the top surface
+# 'merged' merges the flat areas into rectangles,
+# so that the number of triangles follows the shape perimeter
+# 'grid' makes 2 triangles for each pixel
+TOP_MESHING = 'merged'
+
+# Number of pixel rows of the top surface extruded at once
+# when writing an STL file, so that the whole mesh is never in memory.
+# With 'merged' meshing, flat areas are merged across the strips,
+# giving the same triangles as the whole mesh.
+EXTRUSION_STRIP_ROWS = 64
+
+# Engine used to parse the image
+# 'numpy' works on whole arrays and is much faster (requires NumPy)
+# 'python' is the pixel by pixel reference implementation
+PARSE_ENGINE = 'numpy' if numpy is not None else 'python'
+
+# Method used by the numpy engine to find the background color
+# 'histogram' groups the colors in a quantized 3D histogram (single pass)
+# 'greedy' is the reference color group scan (slow, exact)
+BACKGROUND_ESTIMATOR = 'histogram'
+
+# Number of histogram bins on each color axis (power of 2, at most 256)
+HISTOGRAM_BINS = 32
+
+# Maximum number of pixels read to estimate the background
+# Bigger images are sampled, None to always read every pixel
+# With 'random' sampling of n pixels, the dominant color rate is within
+# sqrt(ln(2/d) / 2n) of its exact value with a probability of 1-d
+# (Hoeffding's inequality): for 2^20 samples, within 0.4% with
+# a probability of 99.9999%. This bound does not apply to 'strided'.
+BACKGROUND_SAMPLE = 1 << 20
+
+# How the background sample is chosen
+# 'strided' reads a regular grid of pixels (faster, no copy of the image):
+# its error is not bounded, it misses details thinner than the grid step
+# and is biased by patterns that follow the grid
+# 'random' reads pixels drawn with a fixed seed (see BACKGROUND_SAMPLE)
+BACKGROUND_SAMPLING = 'strided'
+
+# How the numpy engine searches for the rectangle around the shape
+# 'edges' scans inward from each edge and stops at the first foreground
+# row or column, so most of the shape is never read
+# 'projection' projects the whole foreground mask onto rows and columns
+BOUNDING_BOX_SEARCH = 'edges'
+
+# Number of rows or columns read at once by the 'edges' search
+EDGE_SCAN_STEP = 16
+
+# Reuse the background mask computed by the 'histogram' estimator
+# to find the rectangle, instead of reading the image a second time.
+# This mask works on histogram bins, so the rectangle may differ
+# by a few pixels from the exact one. Not used when the image is sampled.
+REUSE_BACKGROUND_MASK = False
+
+# Number of processes analysing big images by tiles of rows
+# (numpy engine). The image is copied once in shared memory,
+# and the result is exactly the one of a single process.
+# 1 to analyse the image in the calling process.
+PARSE_PROCESSES = 1
+
+# Minimum number of pixels of the images analysed by PARSE_PROCESSES
+PARALLEL_MIN_PIXELS = 4 << 20
+
+# Map the pixels of uncompressed RGB images (binary PPM, uncompressed
+# TIFF) in memory instead of decoding them (numpy engine), so that only
+# the pixels that are read are loaded, and the image is never copied.
+# The files must have a header giving their size: headerless raw
+# pixels cannot be opened.
+MAP_RAW_IMAGES = True
+
+# Maximum number of pixels read at once when a whole image is analysed
+# (full color histogram, projection, shape cells), so that the memory used
+# does not depend on the size of the image
+ANALYSIS_CHUNK_PIXELS = 1 << 22
+
+# Maximum size of the reduced image analysed in draft mode
+# (see parseImageDraft for the deviation from the exact result)
+DRAFT_SIZE = 1024
+
+# Maximum memory used to keep decoded images and analysis results
+# between two calls to parseImage, in bytes (0 to disable)
+# Results are reused when only some parameters change,
+# for example the threshold or the width
+CACHE_SIZE = 512 << 20
+
+# Cache of the numpy engine, see CACHE_SIZE
+ANALYSIS_CACHE = LRUCache(CACHE_SIZE)
+
+# Directory of the persistent cache of analysis results
+# (dominant color, shape rectangle and mask, shape image),
+# shared between processes and runs. None to disable it.
+# Entries are keyed by the content of the image file, so that
+# extruding the same photos again skips the image analysis.
+DISK_CACHE_DIRECTORY = None
+
+# Maximum size of the persistent cache in bytes
+DISK_CACHE_SIZE = 1 << 30
+
+# Extensions of the files extruded when a directory is given
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.ppm')
+
+# Profilers of each thread, see profiling
+_profilers = threading.local()
+
 def main():
 	"""
 	Program bootstart function
 	"""
 	# Read arguments
-	if len(sys.argv) != 3:
-		print("""
+	parser = argparse.ArgumentParser(description="""
 This program transforms shape in front of a green background into
 an extruded 3D STL file.
-
-Usage: ./extruder.py image output
-		image: path to the RGB image
-		output: path to the STL file to write
-		""")
+Given several images, directories or glob patterns, it extrudes
+all the images in parallel into the output directory.
+	""")
+	parser.add_argument('image', nargs='+', help='path to the RGB image, or images, directories or glob patterns')
+	parser.add_argument('output', help='path to the STL file to write, or the output directory')
+	parser.add_argument('--no-preview', dest='preview', action='store_false', help='do not show the shape image')
+	parser.add_argument('--jobs', type=int, default=None, help='number of processes for a batch, the number of cores by default')
+	parser.add_argument('--profile', action='store_true', help='print the time spent in each stage')
+	args = parser.parse_args()
+	stlPath = args.output
+	if len(args.image) > 1 or not os.path.isfile(args.image[0]):
+		batchMain(args.image, stlPath, args.jobs, args.profile)
 		return
-	imgPath = sys.argv[1]
-	stlPath = sys.argv[2]
+	imgPath = args.image[0]
+	with profiling() as records:
+		singleMain(imgPath, stlPath, args.preview)
+	if args.profile:
+		print("Stages:")
+		for record in records:
+			print("  " + formatStage(record))
+
+def singleMain(imgPath, stlPath, preview=True):
+	"""
+	Extrudes a single image, showing the shape image if preview is set
+	"""
 	# Reads the image to get a scaled black/white image
 	pixels, dominantColor, dominantColorRate = parseImage(imgPath, COLOR_THRESHOLD, PROFILE_AREA_WIDTH)
 	print "Dominant color (background): " + str(int(dominantColor[0])) + ", " + str(int(dominantColor[1])) + ", " + str(int(dominantColor[2])) + " (" + str(int(dominantColorRate * 100)) + "%)"
 	print("Generated the shape image")
 	# Show the resulting image
-	pixels.show()
+	if preview:
+		pixels.show()
 	# Gets the 3D faces from the image and write to STL
 	extrudeToSTL(stlPath, pixels, SHAPE_UNIT, BASE_Z, SHAPE_Z)
 	print("Written the 3D file to " + stlPath)
@@ -66,18 +205,45 @@ def colorDist(color1, color2):
 	"""
 	return math.sqrt((color2[0] - color1[0])**2 + (color2[1] - color1[1])**2 + (color2[2] - color1[2])**2)
 
-def parseImage(filename, threshold, size):
+def parseImage(filename, threshold, size, engine=None, estimator=None, draft=False):
 	"""
 	Reads an image file 
 	and returns a new square image with the
 	dominant color set as black and the others set as white.
 	Returns a tuple (image, dominant color, dominant color rate)
+	The engine is 'numpy' or 'python', PARSE_ENGINE by default.
+	The background estimator is only used by the numpy engine,
+	the python engine always uses the greedy scan.
+	draft is only supported by the numpy engine.
+	"""
+	if engine is None:
+		engine = PARSE_ENGINE
+	if engine not in ('numpy', 'python'):
+		raise ValueError('unknown parse engine: ' + str(engine))
+	with profileStage('parse'):
+		if engine == 'numpy':
+			return parseImageNumpy(filename, threshold, size, estimator, draft)
+		return parseImagePython(filename, threshold, size)
+
+def compareEngines(filename, threshold, size):
+	"""
+	Parses the image with both engines, using the greedy background
+	estimator for both.
+	Returns True if they give exactly the same result.
+	"""
+	pythonResult = parseImagePython(filename, threshold, size)
+	numpyResult = parseImageNumpy(filename, threshold, size, 'greedy')
+	return (pythonResult[0].tobytes() == numpyResult[0].tobytes()
+		and list(pythonResult[1]) == list(numpyResult[1])
+		and pythonResult[2] == numpyResult[2])
+
+def findDominantColor(pix, width, height, threshold):
+	"""
+	Searches for the dominant color of the image
+	by grouping similar colors together.
+	Each pixel is compared to every group found so far.
+	Returns a tuple (dominant color, dominant color rate)
 	"""
-	# Load the image
-	img = Image.open(filename)
-	pix = img.load()
-	width, height = img.size
-	# Search for the dominant color
 	colorGroups = []
 	dominantGroup = None
 	for x in range(0, width):
@@ -105,6 +271,19 @@ def parseImage(filename, threshold, size):
 				dominantGroup = chosenGroup
 	dominantColor = dominantGroup['color']
 	dominantColorRate = float(dominantGroup['count']) / (height * width)
+	return (dominantColor, dominantColorRate)
+
+def parseImagePython(filename, threshold, size):
+	"""
+	Reference implementation of parseImage,
+	working pixel by pixel in pure Python
+	"""
+	# Load the image
+	img = Image.open(filename)
+	pix = img.load()
+	width, height = img.size
+	# Search for the dominant color
+	dominantColor, dominantColorRate = findDominantColor(pix, width, height, threshold)
 	# Finds and removes the surfaces that are too small (TODO)
 	#minPixels = width*height / 1000
 	#surfaces = []
@@ -181,35 +360,736 @@ def parseImage(filename, threshold, size):
 				newPix[a, b] = (255, 255, 255)
 	return (newImg, dominantColor, dominantColorRate)
 
+def parseImageNumpy(filename, threshold, size, estimator=None, draft=False):
+	"""
+	NumPy implementation of parseImage,
+	working on whole arrays instead of single pixels.
+	Gives exactly the same result as parseImagePython
+	with the 'greedy' background estimator.
+	With draft, the analysis is done on a reduced image (see parseImageDraft).
+	The decoded image and the analysis results are kept in ANALYSIS_CACHE.
+	"""
+	if draft:
+		return parseImageDraft(filename, threshold, size, estimator)
+	key = imageKey(filename)
+	# Reuse the results of previous runs
+	disk = diskCache()
+	background = None
+	if disk is not None:
+		contentKey = ('content', cached(('hash', key), lambda: fileHash(filename), 'hash'))
+		diskKey = (backgroundKey(contentKey, threshold, estimator), BOUNDING_BOX_SEARCH)
+		entry = disk.get(('shape', diskKey, size))
+		if entry is not None:
+			newImg = Image.fromarray(numpy.array(entry['shape']), 'RGB')
+			return (newImg, [float(c) for c in entry['color']], float(entry['rate']))
+		background = disk.get(('box', diskKey))
+	# Load the image
+	data = loadImage(filename, key)
+	analysisKey = (backgroundKey(('image', key), threshold, estimator), BOUNDING_BOX_SEARCH)
+	# Share the analysis of big images between processes
+	tiles = None
+	if PARSE_PROCESSES > 1 and data.shape[0] * data.shape[1] >= PARALLEL_MIN_PIXELS \
+			and ANALYSIS_CACHE.get(('shape', analysisKey, size)) is None:
+		tiles = TilePool(data, PARSE_PROCESSES)
+	try:
+		if background is not None:
+			dominantColor = [float(c) for c in background['color']]
+			dominantColorRate = float(background['rate'])
+			box = tuple(int(v) for v in background['box'])
+		else:
+			# Search for the dominant color
+			dominantColor, dominantColorRate, mask = analyseBackground(('image', key), data, threshold, estimator, tiles)
+			# Finds the rectangle that contains the interesting part of the image
+			box = cached(('box', analysisKey),
+				lambda: findBoundingBox(data, dominantColor, threshold, mask=mask, tiles=tiles),
+				'bounding box', pixelCount(data))
+			if disk is not None:
+				entry = {'color': dominantColor, 'rate': dominantColorRate, 'box': box}
+				if mask is not None:
+					entry['mask'] = mask
+				disk.put(('box', diskKey), entry)
+		newImg = cached(('shape', analysisKey, size),
+			lambda: shapeImage(data, box, size, dominantColor, threshold, tiles),
+			'downscale', pixelCount(data))
+	finally:
+		if tiles is not None:
+			tiles.close()
+	if disk is not None:
+		disk.put(('shape', diskKey, size), {'shape': numpy.asarray(newImg), 'color': dominantColor, 'rate': dominantColorRate})
+	return (newImg.copy(), dominantColor, dominantColorRate)
+
+def parseImageDraft(filename, threshold, size, estimator=None):
+	"""
+	Draft version of parseImageNumpy, for quick previews.
+	The dominant color and the rectangle around the shape are searched
+	on the image reduced by draftFactor (using the JPEG draft mode
+	when possible). The rectangle is then refined at full resolution
+	around the reduced one, and only the full resolution pixels
+	of the final square are averaged.
+	Maximum deviation from the exact result, e being the distance
+	between the dominant color found here and the exact one
+	(distances being euclidean, a distance to the dominant color
+	moves by e at most):
+	- the dominant color is estimated on averaged pixels, which keeps
+	  the average of a uniform background but reduces its noise,
+	  e is not bounded otherwise;
+	- the rectangle is searched at full resolution in the reduced one
+	  widened by 1 reduced pixel (draftFactor source pixels). It only
+	  misses the pixels whose distance to the exact dominant color is
+	  within e of the threshold, and the foreground pixels more than
+	  draftFactor source pixels away from the reduced rectangle,
+	  which vanished from the reduced image;
+	- with the same rectangle, a shape pixel only differs if the
+	  distance of its average color to the exact dominant color
+	  is within e of the threshold.
+	"""
+	key = imageKey(filename)
+	data = loadImage(filename, key)
+	height, width = data.shape[:2]
+	factor = draftFactor(width, height)
+	if factor == 1:
+		return parseImageNumpy(filename, threshold, size, estimator)
+	# Analyse the reduced image
+	smallData = cached(('draft', key, factor), lambda: openDraft(filename, factor, data), 'draft decode')
+	dominantColor, dominantColorRate, mask = analyseBackground(('draft', key, factor), smallData, threshold, estimator)
+	with profileStage('bounding box', pixels=pixelCount(smallData)):
+		minX, maxX, minY, maxY = findBoundingBox(smallData, dominantColor, threshold, mask=mask)
+	box = (width, 0, height, 0)
+	if minX <= maxX:
+		# Refine the rectangle at full resolution, with a margin of 1 reduced pixel
+		scaleX = float(width) / smallData.shape[1]
+		scaleY = float(height) / smallData.shape[0]
+		left = max(int(math.floor((minX - 1) * scaleX)), 0)
+		top = max(int(math.floor((minY - 1) * scaleY)), 0)
+		right = min(int(math.ceil((maxX + 2) * scaleX)), width)
+		bottom = min(int(math.ceil((maxY + 2) * scaleY)), height)
+		with profileStage('bounding box', pixels=(bottom - top) * (right - left)):
+			regionBox = findBoundingBox(data[top:bottom, left:right], dominantColor, threshold)
+		if regionBox[0] <= regionBox[1]:
+			box = (regionBox[0] + left, regionBox[1] + left, regionBox[2] + top, regionBox[3] + top)
+	with profileStage('downscale', pixels=pixelCount(data)):
+		newImg = shapeImage(data, box, size, dominantColor, threshold)
+	return (newImg, dominantColor, dominantColorRate)
+
+def imageKey(filename):
+	"""
+	Identifies the content of an image file
+	by its path, modification time and size
+	"""
+	stat = os.stat(filename)
+	return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+def diskCache():
+	"""
+	Returns the persistent cache in DISK_CACHE_DIRECTORY,
+	or None if it is disabled
+	"""
+	if DISK_CACHE_DIRECTORY is None:
+		return None
+	return DiskCache(DISK_CACHE_DIRECTORY, DISK_CACHE_SIZE)
+
+def cached(key, compute, stage=None, pixels=None):
+	"""
+	Returns the value stored in ANALYSIS_CACHE for key,
+	or computes it with compute() and stores it.
+	The computation is recorded as the given stage (see profileStage),
+	with the number of pixels of the image and the bytes of the value.
+	"""
+	value = ANALYSIS_CACHE.get(key)
+	if value is None:
+		with profileStage(stage, pixels=pixels) as record:
+			value = compute()
+			record['bytes'] = valueSize(value)
+		ANALYSIS_CACHE.put(key, value)
+	return value
+
+def pixelCount(data):
+	"""
+	Number of pixels of an image array
+	"""
+	return data.shape[0] * data.shape[1]
+
+def loadImage(filename, key=None):
+	"""
+	Decodes an image file into an RGB array, using the cache.
+	Uncompressed images are mapped instead, see MAP_RAW_IMAGES.
+	"""
+	if MAP_RAW_IMAGES:
+		data = mapImage(filename)
+		if data is not None:
+			return data
+	if key is None:
+		key = imageKey(filename)
+	return cached(('image', key), lambda: numpy.asarray(Image.open(filename).convert('RGB')), 'decode')
+
+def mapImage(filename):
+	"""
+	Maps the pixels of an uncompressed 8 bits RGB image file
+	(binary PPM, uncompressed TIFF) as a read-only RGB array,
+	without decoding it. Returns None for other images.
+	"""
+	img = Image.open(filename)
+	try:
+		width, height = img.size
+		if img.mode != 'RGB' or not img.tile:
+			return None
+		# The pixels must be stored as consecutive strips of whole rows
+		offset = img.tile[0][2]
+		rows = 0
+		for decoder, box, tileOffset, args in img.tile:
+			if decoder != 'raw' or not isinstance(args, tuple) or tuple(args[:3]) != ('RGB', 0, 1):
+				return None
+			if box[0] != 0 or box[2] != width or box[1] != rows or tileOffset != offset + rows * width * 3:
+				return None
+			rows = box[3]
+		if rows != height:
+			return None
+	finally:
+		img.close()
+	return numpy.memmap(filename, numpy.uint8, 'r', offset, (height, width, 3))
+
+def analyseBackground(key, data, threshold, estimator=None, tiles=None):
+	"""
+	Cached version of findBackground for the RGB array identified by key.
+	The color histogram does not depend on the threshold,
+	so it is cached separately.
+	tiles is an optional TilePool sharing data, see colorHistogram.
+	"""
+	if estimator is None:
+		estimator = BACKGROUND_ESTIMATOR
+	histogram = None
+	if estimator == 'histogram':
+		histogram = cached(('histogram', key, histogramSettings()),
+			lambda: colorHistogram(data, *histogramSettings(), tiles=tiles),
+			'histogram', pixelCount(data))
+	return cached(backgroundKey(key, threshold, estimator),
+		lambda: findBackground(data, threshold, estimator, histogram),
+		'background', pixelCount(data))
+
+def backgroundKey(key, threshold, estimator=None):
+	"""
+	Cache key of the background of the RGB array identified by key,
+	including all the settings the result depends on
+	"""
+	if estimator is None:
+		estimator = BACKGROUND_ESTIMATOR
+	settings = ()
+	if estimator == 'histogram':
+		settings = histogramSettings()
+	return ('background', key, threshold, estimator, settings)
+
+def histogramSettings():
+	"""
+	Settings the color histogram depends on
+	"""
+	return (HISTOGRAM_BINS, BACKGROUND_SAMPLE, BACKGROUND_SAMPLING, REUSE_BACKGROUND_MASK)
+
+def draftFactor(width, height):
+	"""
+	Returns the integer reduction factor used by the draft mode
+	so that the reduced image fits in DRAFT_SIZE
+	"""
+	return max(1, int(math.ceil(float(max(width, height)) / DRAFT_SIZE)))
+
+def openDraft(filename, factor, data=None):
+	"""
+	Returns the RGB array of an image reduced by the given factor.
+	JPEG images are decoded directly at a reduced scale. Other images
+	are reduced from data, their decoded RGB array, if given
+	(see blockMeans), instead of being decoded again.
+	"""
+	img = Image.open(filename)
+	width, height = img.size
+	reducedSize = (max(width // factor, 1), max(height // factor, 1))
+	img.draft('RGB', reducedSize)
+	if img.size == (width, height) and data is not None and width >= factor and height >= factor:
+		img.close()
+		return blockMeans(data, factor)
+	img = img.convert('RGB')
+	if img.size != reducedSize:
+		img = img.resize(reducedSize, Image.BOX)
+	return numpy.asarray(img)
+
+def blockMeans(data, factor):
+	"""
+	Reduces an RGB array by averaging its blocks of factor x factor
+	pixels (the last rows and columns that do not fill a block are
+	left out), by bands of at most ANALYSIS_CHUNK_PIXELS pixels
+	"""
+	height, width = data.shape[0] // factor, data.shape[1] // factor
+	reduced = numpy.empty((height, width, 3), numpy.uint8)
+	step = max(1, ANALYSIS_CHUNK_PIXELS // (width * factor * factor))
+	for first in range(0, height, step):
+		last = min(first + step, height)
+		band = data[first * factor:last * factor, :width * factor]
+		sums = numpy.zeros((last - first, width, 3), numpy.uint32)
+		for i in range(factor):
+			for j in range(factor):
+				sums += band[i::factor, j::factor]
+		reduced[first:last] = (sums + factor * factor // 2) // (factor * factor)
+	return reduced
+
+def findBackground(data, threshold, estimator=None, histogram=None):
+	"""
+	Searches for the dominant color of an RGB array with the given
+	background estimator, BACKGROUND_ESTIMATOR by default.
+	histogram is an optional result of colorHistogram for data.
+	Returns a tuple (dominant color, dominant color rate, foreground mask),
+	the mask is None unless REUSE_BACKGROUND_MASK is set.
+	"""
+	if estimator is None:
+		estimator = BACKGROUND_ESTIMATOR
+	if estimator == 'greedy':
+		height, width = data.shape[:2]
+		pix = Image.fromarray(data, 'RGB').load()
+		dominantColor, dominantColorRate = findDominantColor(pix, width, height, threshold)
+		return (dominantColor, dominantColorRate, None)
+	if estimator == 'histogram' and REUSE_BACKGROUND_MASK:
+		return findDominantColorHistogram(data, threshold, keepMask=True, histogram=histogram)
+	if estimator == 'histogram':
+		dominantColor, dominantColorRate = findDominantColorHistogram(data, threshold, histogram=histogram)
+		return (dominantColor, dominantColorRate, None)
+	raise ValueError('unknown background estimator: ' + str(estimator))
+
+def shapeImage(data, box, size, dominantColor, threshold, tiles=None):
+	"""
+	Creates the square image with only black/white pixels
+	from the square around the rectangle box (minX, maxX, minY, maxY).
+	Only the pixels of data inside the square are read.
+	tiles is an optional TilePool sharing data, see cellAverages.
+	"""
+	height, width = data.shape[:2]
+	xRanges, yRanges = squareCells(box, size, width, height)
+	# Average the color of each cell to decide on the pixel
+	colorAv, counts = cellAverages(data, xRanges, yRanges, tiles)
+	decision = (counts > 0) & (colorDistArray(colorAv, dominantColor) > threshold)
+	newData = numpy.zeros((size, size, 3), numpy.uint8)
+	newData[decision] = 255
+	return Image.fromarray(newData, 'RGB')
+
+def squareCells(box, size, width, height):
+	"""
+	Returns the source pixel ranges (xRanges, yRanges) of the cells
+	of the size x size square centered on the rectangle box
+	"""
+	minX, maxX, minY, maxY = box
+	realWidth = float(maxX - minX)
+	realHeight = float(maxY - minY)
+	realSize = max(realWidth, realHeight)
+	startX = minX + realWidth/2 - realSize / 2
+	startY = minY + realHeight/2 - realSize / 2
+	factor = realSize / size
+	return (cellRanges(startX, factor, size, width), cellRanges(startY, factor, size, height))
+
+def findDominantColorHistogram(data, threshold, bins=None, sample=None, sampling=None, keepMask=False, histogram=None):
+	"""
+	Searches for the dominant color of an RGB array
+	using a quantized 3D color histogram, in a single pass.
+	The most populated bins are then merged with all the bins
+	whose average color is closer than the threshold.
+	Only a sample of the pixels is read if there are more than sample,
+	the defaults are HISTOGRAM_BINS, BACKGROUND_SAMPLE and BACKGROUND_SAMPLING.
+	Returns a tuple (dominant color, dominant color rate),
+	with keepMask a tuple (dominant color, dominant color rate, mask)
+	where mask is True for pixels outside of the dominant bins,
+	or None if the image was sampled.
+	histogram is an optional result of colorHistogram with the same
+	settings, to avoid reading the pixels again.
+	"""
+	if bins is None:
+		bins = HISTOGRAM_BINS
+	if histogram is None:
+		histogram = colorHistogram(data, bins, sample, sampling, keepMask)
+	used, counts, sums, pixelCount, index = histogram
+	colors = sums / counts[:, numpy.newaxis]
+	# Merge the bins around the most populated ones,
+	# moving the group color to the average of its bins
+	dominantColor = None
+	dominantCount = 0
+	dominantGroup = None
+	for seed in numpy.argsort(counts)[::-1][:8]:
+		color = colors[seed]
+		for i in range(0, 4):
+			group = colorDistArray(colors, color) <= threshold
+			if not group.any():
+				break
+			count = counts[group].sum()
+			color = sums[group].sum(axis=0) / count
+		if group.any() and count > dominantCount:
+			dominantColor = color
+			dominantCount = count
+			dominantGroup = group
+	dominantColor = [float(c) for c in dominantColor]
+	dominantColorRate = float(dominantCount) / pixelCount
+	if not keepMask:
+		return (dominantColor, dominantColorRate)
+	mask = None
+	if index is not None:
+		foregroundBins = numpy.ones(bins**3, numpy.bool_)
+		foregroundBins[used[dominantGroup]] = False
+		mask = foregroundBins[index]
+	return (dominantColor, dominantColorRate, mask)
+
+def colorHistogram(data, bins=None, sample=None, sampling=None, keepIndex=False, tiles=None):
+	"""
+	Fills a quantized 3D color histogram of an RGB array
+	with bins bins per axis, reading at most sample pixels.
+	The defaults are HISTOGRAM_BINS, BACKGROUND_SAMPLE and BACKGROUND_SAMPLING.
+	Returns a tuple (used bins, pixel counts, color sums, pixel count, index)
+	with the counts and sums of the non-empty bins only.
+	With keepIndex, index is the bin of each pixel as a 2D array,
+	or None if the image was sampled.
+	Except for 'random' sampling and keepIndex, the pixels are counted
+	by tiles of rows (see mapTiles). The sums are sums of integers,
+	so the result does not depend on the order of the pixels.
+	"""
+	if bins is None:
+		bins = HISTOGRAM_BINS
+	if sample is None:
+		sample = BACKGROUND_SAMPLE
+	if sampling is None:
+		sampling = BACKGROUND_SAMPLING
+	height, width = data.shape[:2]
+	sampled = sample is not None and height * width > sample
+	if not keepIndex and (not sampled or sampling == 'strided'):
+		step = 1
+		if sampled:
+			step = int(math.ceil(math.sqrt(float(height * width) / sample)))
+		counts = numpy.zeros(bins**3, numpy.intp)
+		sums = numpy.zeros((bins**3, 3), numpy.float64)
+		for tileCounts, tileSums in mapTiles(data, tiles, histogramTile, 0, height, bins, step):
+			counts+= tileCounts
+			sums+= tileSums
+		used = numpy.flatnonzero(counts)
+		return (used, counts[used], sums[used], int(counts.sum()), None)
+	pixels = samplePixels(data, sample, sampling)
+	counts, sums, index = binPixels(pixels, bins)
+	# Only keep the non-empty bins
+	used = numpy.flatnonzero(counts)
+	pixelIndex = None
+	if keepIndex and len(pixels) == height * width:
+		pixelIndex = index.reshape(data.shape[:2])
+	return (used, counts[used], sums[used], len(pixels), pixelIndex)
+
+def histogramTile(tile, first, bins, step):
+	"""
+	Counts the pixels of a tile of rows starting at row first
+	for colorHistogram, keeping the pixels of the strided sample
+	of the whole image every step pixels.
+	Returns a tuple (pixel counts, color sums) of all the bins.
+	"""
+	start = (step//2 - first) % step
+	pixels = tile[start::step, step//2::step].reshape(-1, 3)
+	counts, sums, index = binPixels(pixels, bins)
+	return (counts, sums)
+
+def binPixels(pixels, bins):
+	"""
+	Counts an (n, 3) array of pixels in a quantized 3D color histogram.
+	Returns a tuple (pixel counts, color sums, bin of each pixel)
+	"""
+	shift = 8 - int(math.log(bins, 2))
+	indexType = numpy.uint16 if bins**3 <= 1 << 16 else numpy.uint32
+	index = (pixels[:, 0] >> shift).astype(indexType) * (bins * bins)
+	index+= (pixels[:, 1] >> shift).astype(indexType) * bins
+	index+= pixels[:, 2] >> shift
+	counts = numpy.bincount(index, minlength=bins**3)
+	sums = numpy.empty((bins**3, 3), numpy.float64)
+	for i in range(0, 3):
+		sums[:, i] = numpy.bincount(index, weights=pixels[:, i], minlength=bins**3)
+	return (counts, sums, index)
+
+def samplePixels(data, sample, sampling):
+	"""
+	Returns at most sample pixels of an RGB array as an (n, 3) array,
+	or all the pixels if sample is None.
+	sampling is 'strided' (regular grid) or 'random' (fixed seed).
+	"""
+	height, width = data.shape[:2]
+	if sample is None or height * width <= sample:
+		return data.reshape(-1, 3)
+	if sampling == 'strided':
+		step = int(math.ceil(math.sqrt(float(height * width) / sample)))
+		return data[step//2::step, step//2::step].reshape(-1, 3)
+	if sampling == 'random':
+		indices = numpy.random.RandomState(0).randint(0, height * width, sample)
+		return data.reshape(-1, 3)[indices]
+	raise ValueError('unknown sampling: ' + str(sampling))
+
+def colorDistArray(data, color):
+	"""
+	Computes the distance between each color of
+	an array (last axis is RGB) and a single color
+	"""
+	dist = (data[..., 0] - float(color[0]))**2
+	dist+= (data[..., 1] - float(color[1]))**2
+	dist+= (data[..., 2] - float(color[2]))**2
+	return numpy.sqrt(dist)
+
+def findBoundingBox(data, dominantColor, threshold, search=None, mask=None, tiles=None):
+	"""
+	Finds the rectangle containing the pixels of an RGB array
+	that are further than the threshold from the dominant color.
+	If a foreground mask is given, it is used instead of the pixels.
+	search is 'edges' or 'projection', BOUNDING_BOX_SEARCH by default.
+	The 'projection' search reads data by tiles of rows (see mapTiles).
+	With a TilePool sharing data, it is used whatever the search,
+	both giving the same rectangle.
+	Returns a tuple (minX, maxX, minY, maxY)
+	"""
+	if search is None:
+		search = BOUNDING_BOX_SEARCH
+	if mask is not None:
+		return boundingBox(mask)
+	if search == 'projection' or (search == 'edges' and tiles is not None):
+		rows = []
+		columns = numpy.zeros(data.shape[1], numpy.bool_)
+		for tileRows, tileColumns in mapTiles(data, tiles, projectionTile, 0, data.shape[0], dominantColor, threshold):
+			rows.append(tileRows)
+			columns|= tileColumns
+		return projectionBox(numpy.concatenate(rows or [numpy.zeros(0, numpy.bool_)]), columns)
+	if search == 'edges':
+		return edgeBoundingBox(data, dominantColor, threshold)
+	raise ValueError('unknown bounding box search: ' + str(search))
+
+def edgeBoundingBox(data, dominantColor, threshold, step=None):
+	"""
+	Finds the same rectangle as boundingBox, scanning inward
+	from each edge by blocks of step rows or columns
+	(EDGE_SCAN_STEP by default) and stopping at the first
+	foreground row or column. Only the rows of the rectangle
+	are read to find its left and right sides.
+	"""
+	if step is None:
+		step = EDGE_SCAN_STEP
+	height, width = data.shape[:2]
+	def foreground(block, axis):
+		return (colorDistArray(block, dominantColor) > threshold).any(axis=axis)
+	# Top side
+	minY = None
+	for start in range(0, height, step):
+		rows = foreground(data[start:start+step], 1)
+		if rows.any():
+			minY = start + int(numpy.argmax(rows))
+			break
+	if minY is None:
+		return (width, 0, height, 0)
+	# Bottom side, there is at least the row minY
+	for end in range(height, minY, -step):
+		start = max(end - step, minY)
+		rows = foreground(data[start:end], 1)
+		if rows.any():
+			maxY = end - 1 - int(numpy.argmax(rows[::-1]))
+			break
+	band = data[minY:maxY+1]
+	# Left side
+	for start in range(0, width, step):
+		columns = foreground(band[:, start:start+step], 0)
+		if columns.any():
+			minX = start + int(numpy.argmax(columns))
+			break
+	# Right side, there is at least the column minX
+	for end in range(width, minX, -step):
+		start = max(end - step, minX)
+		columns = foreground(band[:, start:end], 0)
+		if columns.any():
+			maxX = end - 1 - int(numpy.argmax(columns[::-1]))
+			break
+	return (minX, maxX, minY, maxY)
+
+def boundingBox(mask):
+	"""
+	Finds the rectangle containing all the True values of a 2D mask.
+	Returns a tuple (minX, maxX, minY, maxY), like the reference loop
+	gives (width, 0, height, 0) if the mask is empty.
+	"""
+	return projectionBox(mask.any(axis=1), mask.any(axis=0))
+
+def projectionBox(rows, columns):
+	"""
+	Finds the rectangle from the projections of a 2D mask,
+	True for the rows and the columns that have a True value
+	"""
+	width, height = len(columns), len(rows)
+	columns = numpy.flatnonzero(columns)
+	rows = numpy.flatnonzero(rows)
+	if len(columns) == 0:
+		return (width, 0, height, 0)
+	return (int(columns[0]), int(columns[-1]), int(rows[0]), int(rows[-1]))
+
+def projectionTile(tile, first, dominantColor, threshold):
+	"""
+	Projects the foreground of a tile of rows for findBoundingBox.
+	Returns a tuple (rows, columns), see projectionBox.
+	"""
+	mask = colorDistArray(tile, dominantColor) > threshold
+	return (mask.any(axis=1), mask.any(axis=0))
+
+def cellAverages(data, xRanges, yRanges, tiles=None):
+	"""
+	Computes the average color of each output cell of an RGB array.
+	Only the pixels covered by the cells are read, by tiles of rows
+	(see mapTiles).
+	Returns a tuple (average colors, pixel counts) of shapes
+	(len(yRanges), len(xRanges), 3) and (len(yRanges), len(xRanges))
+	"""
+	height, width = data.shape[:2]
+	xFrom, xTo = rangeBounds(xRanges, width)
+	yFrom, yTo = rangeBounds(yRanges, height)
+	counts = numpy.outer(yTo - yFrom, xTo - xFrom)
+	# Sums of integers, the order of the tiles does not matter
+	sums = numpy.zeros((len(yRanges), len(xRanges), 3), numpy.int64)
+	for tileSums in mapTiles(data, tiles, cellSums, int(yFrom.min()), int(yTo.max()), xFrom, xTo, yFrom, yTo):
+		sums+= tileSums
+	colorAv = sums / numpy.maximum(counts, 1)[:, :, numpy.newaxis].astype(numpy.float64)
+	return (colorAv, counts)
+
+def mapTiles(data, tiles, function, first, last, *args):
+	"""
+	Calls function(tile, tileFirst, *args) for the tiles of rows of data
+	between first and last, tileFirst being the first row of the tile.
+	The tiles are handled by the processes of tiles, a TilePool sharing data,
+	or else one after the other, with at most ANALYSIS_CHUNK_PIXELS pixels.
+	Yields the results in the order of the tiles.
+	"""
+	if tiles is not None:
+		for result in tiles.map(function, first, last, *args):
+			yield result
+		return
+	rows = max(ANALYSIS_CHUNK_PIXELS // max(data.shape[1], 1), 1)
+	for tileFirst in range(first, last, rows):
+		yield function(data[tileFirst:min(tileFirst + rows, last)], tileFirst, *args)
+
+def cellSums(tile, first, xFrom, xTo, yFrom, yTo):
+	"""
+	Sums the colors of the pixels of each cell inside a tile of rows
+	starting at row first. Uses one summed-area table per channel,
+	so that the cost of a cell does not depend on its size.
+	Returns an array of shape (len(yFrom), len(xFrom), 3)
+	"""
+	# Only keep the columns and the rows of the cells
+	left, right = int(xFrom.min()), int(xTo.max())
+	tile = tile[:, left:right]
+	height, width = tile.shape[:2]
+	xFrom, xTo = xFrom - left, xTo - left
+	yFrom = yFrom.clip(first, first + height) - first
+	yTo = yTo.clip(first, first + height) - first
+	sums = numpy.empty((len(yFrom), len(xFrom), 3), numpy.int64)
+	# table[y, x] is the sum of the pixels above and left of (x, y)
+	table = numpy.zeros((height+1, width+1), numpy.int64)
+	for i in range(0, 3):
+		numpy.cumsum(tile[:, :, i], axis=0, dtype=numpy.int64, out=table[1:, 1:])
+		numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+		sums[:, :, i] = (table[numpy.ix_(yTo, xTo)] - table[numpy.ix_(yFrom, xTo)]
+			- table[numpy.ix_(yTo, xFrom)] + table[numpy.ix_(yFrom, xFrom)])
+	return sums
+
+def rangeBounds(ranges, limit):
+	"""
+	Converts a list of ranges (from, to) into two arrays of bounds
+	clipped to [0, limit], empty ranges having from == to
+	"""
+	bounds = numpy.array(ranges, numpy.intp).reshape(-1, 2).clip(0, limit)
+	return (bounds[:, 0], numpy.maximum(bounds[:, 0], bounds[:, 1]))
+
+def cellRanges(start, factor, size, limit):
+	"""
+	Returns the source pixel ranges (from, to) covered by each
+	of the size output cells along one axis, as in parseImagePython.
+	A range may be empty if to <= from.
+	"""
+	ranges = []
+	for a in range(0, size):
+		cellFrom = int(round(start + a * factor))
+		if cellFrom < 0:
+			cellFrom = 0
+		cellTo = int(round(start + (a+1) * factor))
+		if cellFrom == cellTo:
+			cellTo+= 1
+		if cellTo > limit:
+			cellTo = limit
+		ranges.append((cellFrom, cellTo))
+	return ranges
+
 def addFrame(img, frameWidth):
 	"""
 	Returns a new image that is the same with a white frame around it
 	"""
 	width, height = img.size
-	pix = img.load()
 	newImg = Image.new('RGB', (width+frameWidth*2, height+frameWidth*2), (255, 255, 255))
-	newPix = newImg.load()
-	for x in range(0, width):
-		for y in range(0, height):
-			newPix[x+frameWidth, y+frameWidth] = pix[x, y]
+	newImg.paste(img.convert('RGB'), (frameWidth, frameWidth))
 	return newImg
 	
-def extrude(img, unit, baseZ, fullZ):
+def extrude(img, unit, baseZ, fullZ, meshing=None, frame=0):
 	"""
-	Extrudes the given image and returns a set of faces
-	that can be exported directly to STL
+	Extrudes the given image and returns a Mesh
+	that can be exported directly to STL.
+	meshing is 'merged' or 'grid', TOP_MESHING by default.
+	frame is the width of a white frame added around the image,
+	as with addFrame but without copying the image.
+	Requires NumPy, see extrudeFaces otherwise.
+	"""
+	if meshing is None:
+		meshing = TOP_MESHING
+	if meshing not in ('merged', 'grid'):
+		raise ValueError('unknown meshing: ' + str(meshing))
+	z, x, y = heightmap(img, unit, baseZ, fullZ, frame)
+	return heightmapMesh(z, x, y, meshing == 'merged')
+
+def extrudeChunks(img, unit, baseZ, fullZ, meshing=None, stripRows=None, frame=0):
+	"""
+	Extrudes the given image strip by strip of stripRows rows
+	(EXTRUSION_STRIP_ROWS by default), and yields the triangles
+	as (N, 3, 3) arrays, to be written one after the other to STL.
+	frame is the width of a white frame, as for extrude.
+	Requires NumPy.
+	"""
+	if meshing is None:
+		meshing = TOP_MESHING
+	if meshing not in ('merged', 'grid'):
+		raise ValueError('unknown meshing: ' + str(meshing))
+	if stripRows is None:
+		stripRows = EXTRUSION_STRIP_ROWS
+	z, x, y = heightmap(img, unit, baseZ, fullZ, frame)
+	return heightmapTriangles(z, x, y, meshing == 'merged', stripRows)
+
+def heightmap(img, unit, baseZ, fullZ, frame=0):
+	"""
+	Returns the height of each pixel of the image surrounded by
+	a white frame of frame pixels, and the x and y coordinates
+	of its columns and rows, in millimeters
+	"""
+	width, height = img.size
+	data = numpy.asarray(img.convert('RGB'))
+	# The frame is white, so at the full height
+	width+= 2 * frame
+	height+= 2 * frame
+	z = numpy.empty((height, width))
+	z.fill(fullZ * unit)
+	# Height of each pixel: not black pixels are higher
+	zs = numpy.array([baseZ * unit, fullZ * unit])
+	z[frame:height-frame, frame:width-frame] = zs[(data[:, :, 0] != 0).view(numpy.uint8)]
+	x = (numpy.arange(width) - width/2) * unit
+	y = (height/2 - numpy.arange(height)) * unit
+	return z, x, y
+
+def extrudeFaces(img, unit, baseZ, fullZ):
+	"""
+	Reference implementation of extrude, in pure Python.
+	Returns a set of faces that can be exported directly to STL
 	"""
 	width, height = img.size
 	pix = img.load()
+	# Coordinates of each column and row, and the 2 heights
+	xs = [(x-width/2)*unit for x in range(0, width)]
+	ys = [(height/2-y)*unit for y in range(0, height)]
+	zs = (baseZ*unit, fullZ*unit)
 	# Function to get a point on the top surface from x and y
 	def topPoint(x, y):
-		z = baseZ
-		if pix[x, y][0] != 0:
-			z = fullZ
-		return ((x-width/2)*unit, (height/2-y)*unit, z*unit)
+		return (xs[x], ys[y], zs[pix[x, y][0] != 0])
 	# Function to get a point on the bottom surface from x and y
 	def bottomPoint(x, y):
-		return ((x-width/2)*unit, (height/2-y)*unit, 0)
+		return (xs[x], ys[y], 0)
 	# Constructs a simple square base
 	base = [(bottomPoint(0, 0), bottomPoint(0, height-1), bottomPoint(width-1, height-1), bottomPoint(width-1, 0))]
 	# Constructs the top surface
@@ -229,17 +1109,261 @@ def extrude(img, unit, baseZ, fullZ):
 	shape = base + top + sides
 	return shape
 
-def extrudeToSTL(stlPath, img, unit, baseZ, fullZ):
+def extrudeToSTL(stlPath, img, unit, baseZ, fullZ, stlFormat=None):
 	"""
 	Addes a frame, extrudes and then writes to an STL file
+	The format is 'binary' or 'ascii', STL_FORMAT by default.
 	"""
-	# Gets the 3D faces from the image
-	faces = extrude(addFrame(img, int(fullZ-baseZ)), unit, baseZ, fullZ)
-	# Writes the STL file
-	with open(stlPath, 'w') as fp:
-		writer = STLWriter(fp)
-		writer.add_faces(faces)
+	if stlFormat is None:
+		stlFormat = STL_FORMAT
+	frame = int(fullZ-baseZ)
+	start = time.time()
+	extrudeRecord = {'stage': 'extrude', 'seconds': 0.0, 'faces': 0}
+	# Writes the STL file as the faces are made
+	with open(stlPath, 'wb') as fp:
+		writer = STL_WRITERS[stlFormat](fp)
+		if numpy is not None:
+			for triangles in timedChunks(extrudeChunks(img, unit, baseZ, fullZ, frame=frame), extrudeRecord):
+				writer.add_triangles(triangles)
+		else:
+			faces = extrudeFaces(addFrame(img, frame), unit, baseZ, fullZ)
+			extrudeRecord['seconds'] = time.time() - start
+			extrudeRecord['faces'] = 2 * len(faces)
+			writer.add_faces(faces)
 		writer.close()
+	recordStage(extrudeRecord)
+	recordStage({'stage': 'write', 'seconds': time.time() - start - extrudeRecord['seconds'], 'bytes': os.path.getsize(stlPath)})
+
+def timedChunks(chunks, record):
+	"""
+	Yields the triangle arrays of chunks, adding the time spent
+	making them to record['seconds'] and their number to record['faces']
+	"""
+	chunks = iter(chunks)
+	while True:
+		start = time.time()
+		try:
+			chunk = next(chunks)
+		except StopIteration:
+			record['seconds']+= time.time() - start
+			return
+		record['seconds']+= time.time() - start
+		record['faces']+= len(chunk)
+		yield chunk
+
+def batchMain(patterns, outputDir, jobs=None, profile=False):
+	"""
+	Extrudes the images of a list of files, directories or glob patterns
+	into outputDir, and prints the time spent on each file and the throughput.
+	With profile, also prints the time spent in each stage for all the files.
+	"""
+	imgPaths = sorted(set(path for pattern in patterns for path in imageFiles(pattern)))
+	if not imgPaths:
+		print("No image found in " + " ".join(patterns))
+		return
+	start = time.time()
+	failed = 0
+	stages = []
+	for imgPath, stlPath, parseTime, extrudeTime, error, records in extrudeFiles(imgPaths, outputDir, jobs):
+		stages.extend(records)
+		name = os.path.basename(imgPath)
+		if os.path.splitext(os.path.basename(stlPath))[0] != os.path.splitext(name)[0]:
+			name = imgPath + " (" + os.path.basename(stlPath) + ")"
+		if error is not None:
+			failed+= 1
+			print(name + ": failed, " + error)
+		else:
+			print(name + ": parsed in %.2f s, extruded in %.2f s" % (parseTime, extrudeTime))
+	duration = time.time() - start
+	print("Extruded %d images (%d failed) in %.2f s, %.2f images/s" % (len(imgPaths), failed, duration, len(imgPaths) / duration))
+	if profile:
+		print("Stages, for all the images:")
+		for record in sumStages(stages):
+			print("  " + formatStage(record))
+
+def imageFiles(pattern):
+	"""
+	Returns the sorted list of the image files of a directory
+	(by their extension, see IMAGE_EXTENSIONS) or matching a glob pattern
+	"""
+	if os.path.isdir(pattern):
+		paths = [os.path.join(pattern, name) for name in os.listdir(pattern) if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+	else:
+		paths = glob.glob(pattern)
+	return sorted(path for path in paths if os.path.isfile(path))
+
+def extrudeFiles(imgPaths, outputDir, jobs=None):
+	"""
+	Parses and extrudes each image to an STL file of the same name
+	in outputDir (see stlPaths), with a pool of jobs processes
+	(multiprocessing.cpu_count() by default).
+	Yields a tuple (image path, STL path, parse time, extrude time, error,
+	stages) for each image as soon as it is done, error being None on success
+	and stages the list of the stages recorded (see profiling).
+	The images are never analysed twice, so ANALYSIS_CACHE is not used.
+	"""
+	if not os.path.isdir(outputDir):
+		os.makedirs(outputDir)
+	tasks = zip(imgPaths, stlPaths(imgPaths, outputDir))
+	if jobs is None:
+		jobs = multiprocessing.cpu_count()
+	jobs = max(1, min(jobs, len(tasks)))
+	if jobs == 1:
+		with analysisCache(LRUCache(0)):
+			for task in tasks:
+				yield extrudeFile(task)
+		return
+	pool = multiprocessing.Pool(jobs, batchWorker)
+	try:
+		for result in pool.imap_unordered(extrudeFile, tasks):
+			yield result
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+def stlPaths(imgPaths, outputDir):
+	"""
+	Returns the path of the STL file of each image in outputDir:
+	the name of the image with the .stl extension. The next images
+	of the same name (in other directories or with other extensions)
+	get a numbered name instead, so that no file is written twice.
+	"""
+	names = [os.path.splitext(os.path.basename(imgPath))[0] for imgPath in imgPaths]
+	# Case insensitive, for the file systems that are
+	used = set(name.lower() for name in names)
+	taken = set()
+	paths = []
+	for name in names:
+		if name.lower() in taken:
+			number = 2
+			while (name + '-' + str(number)).lower() in used:
+				number+= 1
+			name+= '-' + str(number)
+			used.add(name.lower())
+		taken.add(name.lower())
+		paths.append(os.path.join(outputDir, name + '.stl'))
+	return paths
+
+def batchWorker():
+	"""
+	Initializes a process of extrudeFiles, without ANALYSIS_CACHE
+	"""
+	global ANALYSIS_CACHE
+	ANALYSIS_CACHE = LRUCache(0)
+
+@contextlib.contextmanager
+def analysisCache(cache):
+	"""
+	Uses cache as ANALYSIS_CACHE in the context
+	"""
+	global ANALYSIS_CACHE
+	previous = ANALYSIS_CACHE
+	ANALYSIS_CACHE = cache
+	try:
+		yield
+	finally:
+		ANALYSIS_CACHE = previous
+
+def extrudeFile(task):
+	"""
+	Parses and extrudes the image of task (image path, STL path)
+	with the default settings, see extrudeFiles
+	"""
+	imgPath, stlPath = task
+	start = time.time()
+	with profiling() as records:
+		try:
+			pixels, dominantColor, dominantColorRate = parseImage(imgPath, COLOR_THRESHOLD, PROFILE_AREA_WIDTH)
+			parseTime = time.time() - start
+			extrudeToSTL(stlPath, pixels, SHAPE_UNIT, BASE_Z, SHAPE_Z)
+		except Exception as e:
+			return (imgPath, stlPath, None, None, str(e) or e.__class__.__name__, records)
+	return (imgPath, stlPath, parseTime, time.time() - start - parseTime, None, records)
+
+@contextlib.contextmanager
+def profiling(callback=None):
+	"""
+	Records the stages run by the current thread in the context
+	(decode, histogram, background, bounding box, downscale, parse,
+	extrude, write...). Yields the list of the records, and calls
+	callback(record) for each one as soon as it is recorded.
+	A record is a dict with the 'stage' name, its duration in 'seconds'
+	and depending on the stage the number of 'pixels' of the image,
+	the number of 'faces' (triangles) made and the 'bytes' of the arrays
+	or of the file made. Stages can be nested: 'parse' includes
+	the stages of the image analysis.
+	"""
+	records = []
+	def profiler(record):
+		records.append(record)
+		if callback is not None:
+			callback(record)
+	profilers = threadProfilers()
+	profilers.append(profiler)
+	try:
+		yield records
+	finally:
+		profilers.remove(profiler)
+
+@contextlib.contextmanager
+def profileStage(stage, **counts):
+	"""
+	Records the duration of the stage run in the context,
+	see profiling. Counts that are None are left out.
+	Yields the record, to which more counts can be added.
+	"""
+	record = dict((name, value) for name, value in counts.items() if value is not None)
+	record['stage'] = stage
+	start = time.time()
+	yield record
+	record['seconds'] = time.time() - start
+	if stage is not None:
+		recordStage(record)
+
+def recordStage(record):
+	"""
+	Sends a stage record to the profilers of the current thread
+	"""
+	for profiler in list(threadProfilers()):
+		profiler(record)
+
+def threadProfilers():
+	"""
+	Returns the list of the profilers of the current thread
+	"""
+	if not hasattr(_profilers, 'list'):
+		_profilers.list = []
+	return _profilers.list
+
+def sumStages(records):
+	"""
+	Adds up the durations and counts of the records of each stage.
+	Returns a list of records, in the order of the first record of each stage.
+	"""
+	stages = []
+	byName = {}
+	for record in records:
+		if record['stage'] not in byName:
+			byName[record['stage']] = {'stage': record['stage']}
+			stages.append(byName[record['stage']])
+		total = byName[record['stage']]
+		for name, value in record.items():
+			if name != 'stage':
+				total[name] = total.get(name, 0) + value
+	return stages
+
+def formatStage(record):
+	"""
+	Returns a line describing a stage record
+	"""
+	line = "%-14s %8.3f s" % (record['stage'] + ":", record['seconds'])
+	for name in ('pixels', 'faces', 'bytes'):
+		if name in record:
+			line+= ", %d %s" % (record[name], name)
+	return line
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -19,6 +19,8 @@ class MainWindow(QtGui.QMainWindow):
 		# Internal state
 		self.__imagePath = None
 		self.__pixels = None
+		# If the pixels come from a draft parsing
+		self.__pixelsDraft = False
 		self.__dominantColor = None
 		self.__dominantColorRate = None
 		self.__worker = None
@@ -28,6 +30,7 @@ class MainWindow(QtGui.QMainWindow):
 		self.__imageLabel  = None
 		self.__thresholdInput = None
 		self.__widthInput = None
+		self.__draftInput = None
 		self.__refreshButton = None
 		self.__previewImage = None
 		self.__unitInput = None
@@ -95,6 +98,11 @@ class MainWindow(QtGui.QMainWindow):
 		hLayout.addWidget(self.__thresholdInput)
 		layout.addLayout(hLayout)
 
+		# Draft mode input
+		self.__draftInput = QtGui.QCheckBox(u"Aperçu rapide (approximatif, l'export reste exact)")
+		self.__draftInput.setChecked(True)
+		layout.addWidget(self.__draftInput)
+
 		# Preview image
 		self.__previewImage = QtGui.QLabel()
 		self.__previewImage.setPixmap(QtGui.QPixmap(PROFILE_AREA_WIDTH, PROFILE_AREA_WIDTH))
@@ -175,7 +183,7 @@ class MainWindow(QtGui.QMainWindow):
 		"""
 		if self.__imagePath is not None:
 			self.__mainWidget.setEnabled(False)
-			self.__worker = ParseWorker(self.__imagePath, self.__threshold, self.__width)
+			self.__worker = ParseWorker(self.__imagePath, self.__threshold, self.__width, self.__draft)
 			self.__worker.finished.connect(self.__refreshImageDone)
 			self.__worker.start()
 
@@ -184,6 +192,8 @@ class MainWindow(QtGui.QMainWindow):
 		The refresh action is done 
 		"""
 		self.__pixels = thread.pixels
+		# The settings cannot change during the parsing
+		self.__pixelsDraft = self.__draft
 		self.__dominantColor = dominantColor
 		self.__dominantColorRate = dominantColorRate
 		self.__previewImage.setPixmap(QtGui.QPixmap(QtGui.QImage(ImageQt.ImageQt(self.__pixels))))
@@ -197,7 +207,11 @@ class MainWindow(QtGui.QMainWindow):
 			filename = QtGui.QFileDialog.getSaveFileName(self, 'Exporter en STL', '', 'Fichier STL (*.stl)')
 			if filename != '':
 				self.__mainWidget.setEnabled(False)
-				self.__worker = ExtrudeWorker(filename, self.__pixels, self.__unit, self.__baseZ, self.__shapeZ)
+				# The draft preview is parsed again exactly for the export
+				parse = None
+				if self.__pixelsDraft:
+					parse = (self.__imagePath, self.__threshold, self.__width)
+				self.__worker = ExtrudeWorker(filename, self.__pixels, self.__unit, self.__baseZ, self.__shapeZ, parse)
 				self.__worker.finished.connect(self.__exportImageDone)
 				self.__worker.start()
 
@@ -215,6 +229,10 @@ class MainWindow(QtGui.QMainWindow):
 	def __threshold(self):
 		return int(self.__thresholdInput.value())
 
+	@property
+	def __draft(self):
+		return self.__draftInput.isChecked()
+
 	@property
 	def __unit(self):
 		return self.__unitInput.value()
@@ -235,7 +253,7 @@ class ParseWorker(QtCore.QThread):
 	# Finished signal
 	finished = QtCore.pyqtSignal(QtCore.QThread, list, float, name="finished")
 
-	def __init__(self, imagePath, threshold, width):
+	def __init__(self, imagePath, threshold, width, draft=False):
 		"""
 		Gets the parameters
 		"""
@@ -243,13 +261,15 @@ class ParseWorker(QtCore.QThread):
 		self.__imagePath = imagePath
 		self.__threshold = threshold
 		self.__width = width
+		self.__draft = draft
 		self.__pixels = None
 
 	def run(self):
 		"""
 		Runs the function
 		"""
-		self.__pixels, dominantColor, dominantColorRate = parseImage(self.__imagePath, self.__threshold, self.__width)
+		with profiling(logStage):
+			self.__pixels, dominantColor, dominantColorRate = parseImage(self.__imagePath, self.__threshold, self.__width, draft=self.__draft)
 		self.finished.emit(self, dominantColor, dominantColorRate)
 
 	@property
@@ -264,13 +284,16 @@ class ExtrudeWorker(QtCore.QThread):
 	# Finished signal
 	finished = QtCore.pyqtSignal(name="finished")
 
-	def __init__(self, filename, pixels, unit, baseZ, shapeZ):
+	def __init__(self, filename, pixels, unit, baseZ, shapeZ, parse=None):
 		"""
-		Gets the parameters
+		Gets the parameters, parse is an optional tuple
+		(image path, threshold, width) to parse the image again
+		without draft instead of extruding pixels
 		"""
 		super(ExtrudeWorker, self).__init__()
 		self.__filename = filename
 		self.__pixels = pixels
+		self.__parse = parse
 		self.__unit = unit
 		self.__baseZ = baseZ
 		self.__shapeZ = shapeZ
@@ -279,9 +302,19 @@ class ExtrudeWorker(QtCore.QThread):
 		"""
 		Runs the function
 		"""
-		extrudeToSTL(self.__filename, self.__pixels, self.__unit, self.__baseZ, self.__shapeZ)
+		with profiling(logStage):
+			pixels = self.__pixels
+			if self.__parse is not None:
+				pixels = parseImage(*self.__parse)[0]
+			extrudeToSTL(self.__filename, pixels, self.__unit, self.__baseZ, self.__shapeZ)
 		self.finished.emit()
 
+def logStage(record):
+	"""
+	Logs the duration of a stage run by a worker
+	"""
+	print(formatStage(record))
+
 def main():
     """
     Start the program
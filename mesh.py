@@ -0,0 +1,386 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Closed triangle meshes of height maps, for the STL writers of stl_writer:
+a top surface of heights above a grid, vertical sides and a flat base.
+Requires NumPy.
+"""
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class Mesh:
+	"""
+	Triangle mesh made of a float32 array of vertices (V, 3)
+	and an int32 array of triangles (N, 3) indexing the vertices
+	"""
+	def __init__(self, vertices, triangles):
+		self.vertices = numpy.asarray(vertices, numpy.float32).reshape(-1, 3)
+		self.triangles = numpy.asarray(triangles, numpy.int32).reshape(-1, 3)
+
+	def __len__(self):
+		return len(self.triangles)
+
+	def triangleArray(self, start=0, stop=None):
+		"""
+		Returns the vertices of the triangles from start to stop
+		as an (N, 3, 3) array
+		"""
+		return self.vertices[self.triangles[start:stop]]
+
+def heightmapMesh(z, x, y, mergeFlat=False, maxError=None):
+	"""
+	Builds the closed mesh of a height map: a grid of top vertices
+	with heights z (H, W) above the x (W,) and y (H,) coordinates,
+	vertical sides and a flat base at height 0.
+	The triangles come in the same order as the faces of the
+	list-based extrusion: base, top (by column), then sides.
+	With mergeFlat, flat areas of the top surface are merged into
+	rectangles (see _mergedTop) and the base is a single fan,
+	so the number of triangles follows the perimeter of the
+	flat areas instead of their area.
+	With maxError, the top surface is simplified so that it stays
+	within maxError (vertically, same unit as z) of the height map
+	(see _simplifiedTop), and the base is a single fan. If this does
+	not reduce the number of triangles (maxError too small for the
+	noise of the heights), the mesh is built without maxError.
+	"""
+	height, width = z.shape
+	if (mergeFlat or maxError is not None) and (height < 2 or width < 2):
+		# Without cells, there is nothing to merge or simplify
+		return heightmapMesh(z, x, y)
+	# Vertices: top grid, then bottom of the 4 sides (y=0, y=h-1, x=0, x=w-1)
+	vertices = numpy.empty((height * width + 2 * (width + height), 3), numpy.float32)
+	top = vertices[:height * width].reshape(height, width, 3)
+	top[:, :, 0] = x[numpy.newaxis, :]
+	top[:, :, 1] = y[:, numpy.newaxis]
+	top[:, :, 2] = z
+	bottom = vertices[height * width:]
+	bottom[:, 2] = 0
+	bottom[:width, 0] = x
+	bottom[:width, 1] = y[0]
+	bottom[width:2 * width, 0] = x
+	bottom[width:2 * width, 1] = y[-1]
+	bottom[2 * width:2 * width + height, 0] = x[0]
+	bottom[2 * width:2 * width + height, 1] = y
+	bottom[2 * width + height:, 0] = x[-1]
+	bottom[2 * width + height:, 1] = y
+	# Vertex indices
+	cols = numpy.arange(width, dtype=numpy.int32)
+	rows = numpy.arange(height, dtype=numpy.int32)
+	bottomFirst = height * width + cols
+	bottomLast = height * width + width + cols
+	leftBottom = height * width + 2 * width + rows
+	rightBottom = height * width + 2 * width + height + rows
+	topFirst = cols
+	topLast = (height - 1) * width + cols
+	leftTop = rows * width
+	rightTop = rows * width + width - 1
+	# Base
+	base = numpy.array([[bottomFirst[0], bottomLast[0], bottomLast[-1], bottomFirst[-1]]], numpy.int32)
+	# Top surface, by column then by row
+	grid = numpy.arange(height * width, dtype=numpy.int32).reshape(height, width)
+	p1 = grid[:-1, :-1].T.ravel()
+	topQuads = numpy.column_stack((p1, p1 + 1, p1 + width + 1, p1 + width))
+	# Sides, the 2 sides along x then the 2 sides along y
+	front = numpy.column_stack((bottomFirst[:-1], bottomFirst[1:], topFirst[1:], topFirst[:-1]))
+	back = numpy.column_stack((bottomLast[:-1], bottomLast[1:], topLast[1:], topLast[:-1]))
+	left = numpy.column_stack((leftBottom[:-1], leftBottom[1:], leftTop[1:], leftTop[:-1]))
+	right = numpy.column_stack((rightBottom[:-1], rightBottom[1:], rightTop[1:], rightTop[:-1]))
+	sides = numpy.concatenate((
+		numpy.stack((front, back), axis=1).reshape(-1, 4),
+		numpy.stack((left, right), axis=1).reshape(-1, 4)))
+	if not mergeFlat and maxError is None:
+		quads = numpy.concatenate((base, topQuads, sides))
+		# Same split as the _split of stl_writer: (p1, p2, p3), (p3, p4, p1)
+		return Mesh(vertices, quads[:, [0, 1, 2, 2, 3, 0]].reshape(-1, 3))
+	# Base fan around its center, through all the bottom vertices of the sides
+	baseRing = numpy.concatenate((leftBottom[:-1], bottomLast[:-1], rightBottom[:0:-1], bottomFirst[:0:-1]))
+	baseCenter = numpy.array([[(x[0] + x[-1]) / 2.0, (y[0] + y[-1]) / 2.0, 0]], numpy.float32)
+	base = _fan(baseRing, len(vertices))
+	if maxError is not None:
+		top = _simplifiedTop(z, grid, maxError)
+		if len(base) + len(top) >= 2 + 2 * len(topQuads):
+			return heightmapMesh(z, x, y, mergeFlat)
+		centers = numpy.empty((0, 3), numpy.float32)
+	else:
+		top, centers = _mergedTop(z, x, y, grid, len(vertices) + 1)
+	vertices = numpy.concatenate((vertices, baseCenter, centers))
+	sides = sides[:, [0, 1, 2, 2, 3, 0]].reshape(-1, 3)
+	return Mesh(vertices, numpy.concatenate((base, top, sides)))
+
+def heightmapTriangles(z, x, y, mergeFlat=False, stripRows=64):
+	"""
+	Streaming version of heightmapMesh: yields the triangles of
+	the closed mesh as (N, 3, 3) float32 arrays, the base first,
+	then the top surface by strips of stripRows rows, then the sides.
+	Only the triangles of one strip are held in memory at a time.
+	With mergeFlat, the flat areas are found on the whole height map
+	(see _flatRectangles), and each rectangle is yielded with the
+	strip of its last row, so the triangles are the same as the ones
+	of heightmapMesh.
+	"""
+	height, width = z.shape
+	# Without cells, there is nothing to merge
+	mergeFlat = mergeFlat and height >= 2 and width >= 2
+	x = numpy.asarray(x, numpy.float64)
+	y = numpy.asarray(y, numpy.float64)
+	z = numpy.asarray(z, numpy.float64)
+	cols = numpy.arange(width)
+	rows = numpy.arange(height)
+	# Bottom of the sides, clockwise as the base quad
+	ring = numpy.concatenate((
+		_points(x[0], y[rows[:-1]], 0),
+		_points(x[cols[:-1]], y[-1], 0),
+		_points(x[-1], y[rows[:0:-1]], 0),
+		_points(x[cols[:0:-1]], y[0], 0)))
+	if mergeFlat:
+		center = numpy.array([(x[0] + x[-1]) / 2.0, (y[0] + y[-1]) / 2.0, 0])
+		yield _asTriangles(numpy.column_stack((
+			numpy.repeat(center[numpy.newaxis], len(ring), axis=0), ring, numpy.roll(ring, -1, axis=0)
+		)).reshape(-1, 3, 3))
+	else:
+		corners = _points(x[[0, 0, -1, -1]], y[[0, -1, -1, 0]], 0)
+		yield _asTriangles(corners[[0, 1, 2, 2, 3, 0]])
+	if mergeFlat:
+		flat, rectangles, used = _flatRectangles(z)
+		stripRectangles = [[] for first in range(0, height - 1, stripRows)]
+		for rectangle in rectangles:
+			stripRectangles[(rectangle[4] - 1) // stripRows].append(rectangle)
+	# Top surface, by strips sharing their first and last rows
+	for first in range(0, height - 1, stripRows):
+		last = min(first + stripRows, height - 1)
+		if mergeFlat:
+			yield _mergedStrip(z, x, y, flat, stripRectangles[first // stripRows], used, first, last)
+			continue
+		stripZ = z[first:last + 1]
+		stripY = y[first:last + 1]
+		stripHeight = last + 1 - first
+		vertices = numpy.empty((stripHeight, width, 3))
+		vertices[:, :, 0] = x[numpy.newaxis, :]
+		vertices[:, :, 1] = stripY[:, numpy.newaxis]
+		vertices[:, :, 2] = stripZ
+		vertices = vertices.reshape(-1, 3)
+		grid = numpy.arange(stripHeight * width, dtype=numpy.int32).reshape(stripHeight, width)
+		p1 = grid[:-1, :-1].ravel()
+		quads = numpy.column_stack((p1, p1 + 1, p1 + width + 1, p1 + width))
+		triangles = quads[:, [0, 1, 2, 2, 3, 0]].reshape(-1, 3)
+		yield _asTriangles(vertices[triangles])
+	# Sides, the 2 sides along x then the 2 sides along y
+	front = _sideQuads(_points(x, y[0], 0), _points(x, y[0], z[0]))
+	back = _sideQuads(_points(x, y[-1], 0), _points(x, y[-1], z[-1]))
+	left = _sideQuads(_points(x[0], y, 0), _points(x[0], y, z[:, 0]))
+	right = _sideQuads(_points(x[-1], y, 0), _points(x[-1], y, z[:, -1]))
+	quads = numpy.concatenate((
+		numpy.stack((front, back), axis=1).reshape(-1, 4, 3),
+		numpy.stack((left, right), axis=1).reshape(-1, 4, 3)))
+	yield _asTriangles(quads[:, [0, 1, 2, 2, 3, 0]])
+
+def _points(x, y, z):
+	"""
+	(N, 3) array of points from coordinates, scalars being repeated
+	"""
+	x, y, z = numpy.broadcast_arrays(x, y, z)
+	return numpy.column_stack((x.ravel(), y.ravel(), z.ravel()))
+
+def _sideQuads(bottom, top):
+	"""
+	Quads (N-1, 4, 3) of a side between 2 lines of N points
+	"""
+	return numpy.stack((bottom[:-1], bottom[1:], top[1:], top[:-1]), axis=1)
+
+def _asTriangles(points):
+	"""
+	float32 (N, 3, 3) array of triangles from a list of points
+	"""
+	return numpy.asarray(points, numpy.float32).reshape(-1, 3, 3)
+
+def _mergedTop(z, x, y, grid, firstCenter):
+	"""
+	Triangulates the top surface of a height map, merging the
+	flat cells into rectangles (see _flatRectangles).
+	A rectangle goes through all the vertices used on its edges by
+	its neighbours, so that the surface has no T-junction: it is
+	made of 2 triangles or, if needed, of a fan around a new center
+	vertex. Other cells are split in 2 triangles as usual.
+	Returns (triangles, center vertices), the center vertices being
+	numbered from firstCenter.
+	"""
+	width = z.shape[1]
+	flat, rectangles, used = _flatRectangles(z)
+	# Sloped cells, 2 triangles each
+	sloped = ~flat
+	p1 = grid[:-1, :-1].T[sloped.T]
+	quads = numpy.column_stack((p1, p1 + 1, p1 + width + 1, p1 + width))
+	triangles = [quads[:, [0, 1, 2, 2, 3, 0]].reshape(-1, 3)]
+	# Rectangles, clockwise from the top left corner as the cells
+	centers = []
+	for x0, x1, level, y0, y1 in rectangles:
+		ring = _ring(grid, used, x0, x1, y0, y1)
+		if len(ring) == 4:
+			triangles.append(ring[[0, 1, 2, 2, 3, 0]].reshape(-1, 3))
+		else:
+			triangles.append(_fan(ring, firstCenter + len(centers)))
+			centers.append(((x[x0] + x[x1]) / 2.0, (y[y0] + y[y1]) / 2.0, level))
+	centers = numpy.array(centers, numpy.float32).reshape(-1, 3)
+	return (numpy.concatenate(triangles).astype(numpy.int32), centers)
+
+def _mergedStrip(z, x, y, flat, rectangles, used, first, last):
+	"""
+	Triangles (N, 3, 3) of the top surface of a height map between
+	the rows first and last, as _mergedTop: the sloped cells of these
+	rows and the given rectangles, which end in these rows
+	"""
+	rows, cols = numpy.nonzero(~flat[first:last])
+	rows += first
+	quads = numpy.stack((
+		_points(x[cols], y[rows], z[rows, cols]),
+		_points(x[cols + 1], y[rows], z[rows, cols + 1]),
+		_points(x[cols + 1], y[rows + 1], z[rows + 1, cols + 1]),
+		_points(x[cols], y[rows + 1], z[rows + 1, cols])), axis=1)
+	triangles = [quads[:, [0, 1, 2, 2, 3, 0]].reshape(-1, 3)]
+	for x0, x1, level, y0, y1 in rectangles:
+		rows, cols = _ringCells(used, x0, x1, y0, y1)
+		ring = _points(x[cols], y[rows], z[rows, cols])
+		if len(ring) == 4:
+			triangles.append(ring[[0, 1, 2, 2, 3, 0]])
+		else:
+			center = numpy.array([(x[x0] + x[x1]) / 2.0, (y[y0] + y[y1]) / 2.0, level])
+			triangles.append(numpy.column_stack((
+				numpy.repeat(center[numpy.newaxis], len(ring), axis=0), ring, numpy.roll(ring, -1, axis=0)
+			)).reshape(-1, 3))
+	return _asTriangles(numpy.concatenate(triangles))
+
+def _flatRectangles(z):
+	"""
+	Finds the flat cells of a height map (4 corners at the same
+	height), and merges them into rectangles: identical runs of
+	flat cells on consecutive rows are merged.
+	Returns (flat, rectangles, used): flat (H-1, W-1) is True for
+	the flat cells, rectangles is the list of the (x0, x1, level, y0, y1)
+	rectangles of cells x0 to x1-1 and y0 to y1-1, and used (H, W)
+	is True for the vertices used on the edges of the rectangles
+	"""
+	height, width = z.shape
+	corner = z[:-1, :-1]
+	flat = (corner == z[:-1, 1:]) & (corner == z[1:, :-1]) & (corner == z[1:, 1:])
+	# Rectangles (x0, x1, level, y0, y1) of cells x0 to x1-1 and y0 to y1-1
+	rectangles = []
+	opened = {}
+	for row in range(height - 1):
+		rowFlat = flat[row]
+		rowZ = corner[row]
+		changes = numpy.flatnonzero((rowFlat[1:] != rowFlat[:-1]) | (rowZ[1:] != rowZ[:-1])) + 1
+		starts = numpy.concatenate(([0], changes))
+		ends = numpy.concatenate((changes, [width - 1]))
+		runs = set((int(start), int(end), rowZ[start]) for start, end in zip(starts, ends) if rowFlat[start])
+		for run in list(opened):
+			if run not in runs:
+				rectangles.append(run + (opened.pop(run), row))
+		for run in runs:
+			if run not in opened:
+				opened[run] = row
+	for run, firstRow in opened.items():
+		rectangles.append(run + (firstRow, height - 1))
+	# Vertices used on the edges: corners of all the pieces, and the
+	# borders where the sides are attached
+	sloped = ~flat
+	used = numpy.zeros((height, width), bool)
+	used[:-1, :-1] |= sloped
+	used[:-1, 1:] |= sloped
+	used[1:, :-1] |= sloped
+	used[1:, 1:] |= sloped
+	used[0, :] = used[-1, :] = used[:, 0] = used[:, -1] = True
+	for x0, x1, level, y0, y1 in rectangles:
+		used[y0, x0] = used[y0, x1] = used[y1, x0] = used[y1, x1] = True
+	return (flat, rectangles, used)
+
+def _simplifiedTop(z, grid, maxError):
+	"""
+	Triangulates the top surface of a height map with a quadtree.
+	A block of cells is kept if its fan of 4 triangles around its
+	center vertex stays within maxError / 2 of the heights of
+	the block, otherwise it is split in 4. Blocks of 1 cell are
+	always kept. Each block is then a fan around its center going
+	through all the vertices used on its edges by its neighbours
+	(so there is no T-junction). The extra edge vertices change the
+	surface by at most maxError / 2, so it stays within maxError.
+	Returns the triangles.
+	"""
+	height, width = z.shape
+	tolerance = maxError / 2.0
+	leaves = []
+	blocks = [(0, width - 1, 0, height - 1)]
+	while blocks:
+		x0, x1, y0, y1 = blocks.pop()
+		if (x1 - x0 == 1 and y1 - y0 == 1) or \
+				(x1 - x0 >= 2 and y1 - y0 >= 2 and _fanError(z, x0, x1, y0, y1) <= tolerance):
+			leaves.append((x0, x1, y0, y1))
+			continue
+		xs = [x0, (x0 + x1) // 2, x1] if x1 - x0 >= 2 else [x0, x1]
+		ys = [y0, (y0 + y1) // 2, y1] if y1 - y0 >= 2 else [y0, y1]
+		for i in range(len(xs) - 1):
+			for j in range(len(ys) - 1):
+				blocks.append((xs[i], xs[i + 1], ys[j], ys[j + 1]))
+	# Vertices used on the edges: corners of all the blocks, and the
+	# borders where the sides are attached
+	used = numpy.zeros((height, width), bool)
+	used[0, :] = used[-1, :] = used[:, 0] = used[:, -1] = True
+	for x0, x1, y0, y1 in leaves:
+		used[y0, x0] = used[y0, x1] = used[y1, x0] = used[y1, x1] = True
+	triangles = []
+	for x0, x1, y0, y1 in leaves:
+		ring = _ring(grid, used, x0, x1, y0, y1)
+		if x1 - x0 == 1:
+			triangles.append(ring[[0, 1, 2, 2, 3, 0]].reshape(-1, 3))
+		else:
+			triangles.append(_fan(ring, grid[(y0 + y1) // 2, (x0 + x1) // 2]))
+	return numpy.concatenate(triangles).astype(numpy.int32)
+
+def _fanError(z, x0, x1, y0, y1):
+	"""
+	Maximum vertical distance between the heights of a block
+	and its fan of 4 triangles around the center vertex
+	"""
+	cx, cy = (x0 + x1) // 2, (y0 + y1) // 2
+	ys, xs = numpy.mgrid[y0:y1 + 1, x0:x1 + 1]
+	block = z[y0:y1 + 1, x0:x1 + 1]
+	error = numpy.zeros(block.shape)
+	corners = ((x0, y0), (x1, y0), (x1, y1), (x0, y1))
+	for i in range(4):
+		(ax, ay), (bx, by) = corners[i], corners[(i + 1) % 4]
+		# Barycentric coordinates in the triangle (center, a, b)
+		det = float((ax - cx) * (by - cy) - (bx - cx) * (ay - cy))
+		la = ((xs - cx) * (by - cy) - (bx - cx) * (ys - cy)) / det
+		lb = ((ax - cx) * (ys - cy) - (xs - cx) * (ay - cy)) / det
+		inside = (la >= 0) & (lb >= 0) & (la + lb <= 1)
+		approx = (1 - la - lb) * z[cy, cx] + la * z[ay, ax] + lb * z[by, bx]
+		error[inside] = abs(block - approx)[inside]
+	return error.max()
+
+def _ring(grid, used, x0, x1, y0, y1):
+	"""
+	Used vertices on the edges of the block of cells x0 to x1-1
+	and y0 to y1-1, clockwise from its top left corner as the cells
+	"""
+	rows, cols = _ringCells(used, x0, x1, y0, y1)
+	return grid[rows, cols]
+
+def _ringCells(used, x0, x1, y0, y1):
+	"""
+	Rows and columns of the vertices of _ring
+	"""
+	top = numpy.arange(x0, x1)[used[y0, x0:x1]]
+	right = numpy.arange(y0, y1)[used[y0:y1, x1]]
+	bottom = numpy.arange(x1, x0, -1)[used[y1, x1:x0:-1]]
+	left = numpy.arange(y1, y0, -1)[used[y1:y0:-1, x0]]
+	return (
+		numpy.concatenate((numpy.full(len(top), y0, int), right, numpy.full(len(bottom), y1, int), left)),
+		numpy.concatenate((top, numpy.full(len(right), x1, int), bottom, numpy.full(len(left), x0, int))))
+
+def _fan(ring, center):
+	"""
+	Triangles (center, ring[i], ring[i+1]) around a closed ring
+	"""
+	return numpy.column_stack((numpy.full(len(ring), center, numpy.int32), ring, numpy.roll(ring, -1)))
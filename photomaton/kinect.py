@@ -1,9 +1,28 @@
-import freenect
 import numpy
+import os
 import scipy.misc
+import sys
+import threading
+import time
+# The meshes are built by the module of the extruder, in the parent directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mesh import heightmapMesh
+try:
+	import freenect
+except ImportError:
+	freenect = None
 
-# Number of depth images used to compute one averaged image
+# Depth device: 'freenect' (Kinect) or 'fake' (synthetic frames, no hardware needed)
+DEVICE = 'freenect'
+# Frame rate of the fake device (frames per second)
+FAKE_FRAME_RATE = 30
+# Number of last depth images filtered into one image
 AVERAGE_WINDOW = 5
+# Filter of the last AVERAGE_WINDOW depth images, updated for each image:
+# 'min' (nearest point), 'median' or 'mean' (both of the known points only)
+DEPTH_FILTER = 'min'
+# Depth value of the unknown points
+UNKNOWN_DEPTH = 2047
 # Maximum real depth difference from the nearest point
 MAX_REAL_DEPTH_DIFF = 110
 # Object width
@@ -18,41 +37,70 @@ BASE_DEPTH = 6
 VERTICAL_PIXEL_SIZE = 0.16
 # Horizontal pixel size (mm)
 HORIZONTAL_PIXEL_SIZE = 0.2
+# Maximum vertical error of the simplified surface (mm)
+# (None = export every pixel). The surface is kept within half of it
+# before the joins, which must exceed the noise of one depth step
+# of the Kinect, or nothing is simplified.
+MAX_VERTICAL_ERROR = 3 * VERTICAL_PIXEL_SIZE
 # Export filename (None = to choose in the GUI)
 EXPORT_FILENAME = None
+# Export format: 'binary' (about 5 times smaller) or 'ascii'
+EXPORT_FORMAT = 'binary'
+# Value of the unknown points of the captured data (after scaling)
+HOLE_VALUE = 255
+# Maximum length of the holes of unknown points that are interpolated
+MAX_HOLE_LENGTH = 20
 
 class Kinect:
 	"""
 	Gets and treats data from the kinect.
 	"""
-	def __init__(self):
-		# Keeps the depth to compute an average
-		self.__depthHistory = []
-		# Depth data, averaged
+	def __init__(self, device=None):
+		# Depth device, created from DEVICE if not given
+		self.__device = device
+		# Acquisition thread, started on the first read
+		self.__acquisition = None
+		# Depth data, filtered
 		self.__depthData = numpy.zeros((480, 640), numpy.uint16)
 		# Selection rectangle for the capture (start point, dimensions)
 		self.__rect = [[0, 0], [480, 480]]
+		# Grey-scale images of the depth and captured data
+		self.__depthImage = DepthImage()
+		self.__capturedImage = DepthImage()
 		# Captured data, improved as much as possible
 		self.__capturedData = None
+		# Mesh of the captured data, computed when needed
+		self.__capturedMesh = None
+		# Maximum vertical error of the mesh surface (mm)
+		self.__maxError = MAX_VERTICAL_ERROR
 
 	def readDepth(self):
 		"""
-		Reads the depth from the Kinect.
+		Takes the newest filtered depth from the acquisition thread,
+		which is started on the first call and reads the device in the background.
 		Returns if raw depth data has been updated.
 		Raises a Kinect.KinectError if there are communication problems with the Kinect
 		"""
-		response = freenect.sync_get_depth()
-		if response is None:
-			raise Kinect.KinectError("not replying")
-		self.__depthHistory.append(response[0])
-		if len(self.__depthHistory) >= AVERAGE_WINDOW:
-			newData = self.__depthHistory[0]
-			for i in range(0, AVERAGE_WINDOW):
-				newData = numpy.minimum(newData, self.__depthHistory[i])
-			self.__depthData = newData
-			self.__depthHistory = []
-			return True
-		return False
+		if self.__acquisition is None:
+			if self.__device is None:
+				self.__device = createDevice()
+			self.__acquisition = DepthAcquisition(self.__device)
+			self.__acquisition.start()
+		depth = self.__acquisition.takeDepth()
+		if depth is None:
+			if self.__acquisition.error is not None:
+				raise self.__acquisition.error
+			return False
+		self.__depthData = depth
+		return True
+
+	def stop(self):
+		"""
+		Stops the acquisition thread
+		"""
+		if self.__acquisition is not None:
+			self.__acquisition.stop()
+			self.__acquisition = None
 
 	def selectRect(self, rect):
 		"""
@@ -60,18 +108,30 @@ class Kinect:
 		"""
 		self.__rect = rect
 
-	def capture(self):
+	def setMaxError(self, maxError):
+		"""
+		Sets the maximum vertical error of the mesh surface (mm),
+		None to keep every pixel
 		"""
-		Capture data currently in the rectangle
-		and convert data to a nice object representation
+		if maxError != self.__maxError:
+			self.__maxError = maxError
+			self.__capturedMesh = None
+
+	def capture(self, depth=None):
 		"""
-		self.__capturedData = self.rectDepth.astype(numpy.uint32)
+		Capture data currently in the rectangle (or the given depth,
+		see captureDepth) and convert data to a nice object representation.
+		The captured data is unchanged if an error is raised.
+		"""
+		if depth is None:
+			depth = self.captureDepth()
+		data = depth.astype(numpy.uint32)
 		# Detect and remove the background
-		mini = numpy.amin(self.__capturedData)
-		maxi = numpy.amax(self.__capturedData)
+		mini = numpy.amin(data)
+		maxi = numpy.amax(data)
 		if maxi - mini == 0:
 			maxi+= 1
-		histo = numpy.histogram(self.__capturedData, maxi - mini, (mini, maxi))[0]
+		histo = numpy.histogram(data, maxi - mini, (mini, maxi))[0]
 		i = 2
 		while i < (maxi - mini) and histo[i] > 0:
 			i+= 1
@@ -79,15 +139,17 @@ class Kinect:
 		# Limit the maximum depth, forgets far points
 		if maxi - mini > MAX_REAL_DEPTH_DIFF:
 			maxi = mini + MAX_REAL_DEPTH_DIFF
-		self.__capturedData = (255 * (self.__capturedData - mini)) / (maxi - mini)
-		self.__capturedData = self.__capturedData.clip(0, 255)
+		data = (255 * (data - mini)) / (maxi - mini)
+		data = data.clip(0, 255)
 		# Interpolate data to remove unknown data holes
-		self.__capturedData = self.__interpolate(self.__capturedData)
+		data = self.__interpolate(data)
 		# Scale data width and height (works only with data scaled between 0 and 255)
-		self.__capturedData = scipy.misc.imresize(self.__capturedData, (OBJECT_WIDTH, OBJECT_HEIGHT))
+		data = scipy.misc.imresize(data, (OBJECT_WIDTH, OBJECT_HEIGHT))
 		# Scale depth
-		self.__capturedData = self.__capturedData.astype(numpy.uint32)
-		self.__capturedData = (self.__capturedData * OBJECT_DEPTH) / 255
+		data = data.astype(numpy.uint32)
+		data = (data * OBJECT_DEPTH) / 255
+		self.__capturedData = data
+		self.__capturedMesh = None
 
 	def __interpolate(self, data):
 		"""
@@ -95,56 +157,7 @@ class Kinect:
 		Interpolates to replace values equal to 255.
 		If they are in holes.
 		"""
-		fixedData = data.copy()
-		width = data.shape[0]
-		height = data.shape[1]
-		for x in range(0, width):
-			# Vertical interpolation
-			gapStart = None
-			gapEnd = None
-			beforeVal = None
-			afterVal = None
-			for y in range(0, height):
-				val = self.__capturedData[x,y]
-				if val != 255:
-					if gapStart is not None:
-						gapEnd = y - 1
-						afterVal = val
-						if beforeVal is not None and gapEnd - gapStart < 20:
-							for modY in range(gapStart, gapEnd+1):
-								fixedData[x,modY] = beforeVal + ((int(afterVal) - beforeVal) * (modY + 1 - gapStart)) / (gapEnd + 2 - gapStart)
-						gapStart = None
-						gapEnd = None
-					else:
-						beforeVal = val
-				elif gapStart is None:
-					gapStart = y
-		for y in range(0, height):
-			# Horizontal interpolation
-			gapStart = None
-			gapEnd = None
-			beforeVal = None
-			afterVal = None
-			for x in range(0, width):
-				val = self.__capturedData[x,y]
-				if val != 255:
-					if gapStart is not None:
-						gapEnd = x - 1
-						afterVal = val
-						if beforeVal is not None and gapEnd - gapStart < 20:
-							for modX in range(gapStart, gapEnd+1):
-								newVal = beforeVal + ((int(afterVal) - beforeVal) * (modX + 1 - gapStart)) / (gapEnd + 2 - gapStart)
-								if fixedData[modX,y] == 255:
-									fixedData[modX,y] = newVal
-								else:
-									fixedData[modX,y] = (fixedData[modX,y] + newVal) / 2
-						gapStart = None
-						gapEnd = None
-					else:
-						beforeVal = val
-				elif gapStart is None:
-					gapStart = x
-		return fixedData
+		return interpolateHoles(data)
 
 	@property
 	def depth(self):
@@ -162,35 +175,59 @@ class Kinect:
 			return self.depth.copy()
 		return self.depth[self.__rect[0][1]:(self.__rect[0][1]+self.__rect[1][1]),self.__rect[0][0]:(self.__rect[0][0]+self.__rect[1][0])]
 
+	def captureDepth(self):
+		"""
+		Returns a copy of the data in the selected rectangle, which
+		can be captured in another thread while the depth is read
+		"""
+		return numpy.array(self.rectDepth)
+
 	@property
 	def rgb32Depth(self):
 		"""
-		Data as a 32 bits RGB grey-scale image (numpy 32-bit array)
+		Data as a 32 bits RGB grey-scale image (numpy 32-bit array),
+		scaled to the selected rectangle. The array is reused for each call.
 		"""
-		depth = self.depth.astype(numpy.uint32)
-		# Transforms a 16-bit value into an 8-bit value
-		depth = self.__scaleToByte(depth, self.rectDepth)
-		# Transforms to RGB
-		depth = self.__depthToRGB(depth)
-		return depth
+		return self.__depthImage.update(self.depth, self.rectDepth)
 
 	@property 
 	def rgb32Captured(self):
 		"""
-		Returns the last captured data 
+		Returns the last captured data as a 32 bits RGB grey-scale image
+		(numpy 32-bit array). The array is reused for each call.
 		"""
 		if self.__capturedData is None:
 			return None
-		data = self.__capturedData.astype(numpy.uint32)
-		data = self.__scaleToByte(data)
-		data = self.__depthToRGB(data)
-		return data
+		return self.__capturedImage.update(self.__capturedData)
 
 	@property
 	def stlCaptured(self):
 		"""
-		Transform the selected data into a set of faces
-		that can be exported directly to STL
+		Transform the selected data into a Mesh
+		that can be exported directly to STL.
+		The surface is simplified within the maximum vertical error.
+		"""
+		if self.__capturedMesh is None:
+			self.__capturedMesh = self.__meshCaptured()
+		return self.__capturedMesh
+
+	@property
+	def maxError(self):
+		"""
+		Maximum vertical error of the mesh surface (mm)
+		"""
+		return self.__maxError
+
+	@property
+	def gridTriangleCount(self):
+		"""
+		Number of triangles of the mesh without simplification
+		"""
+		return 2 * (OBJECT_WIDTH-1) * (OBJECT_HEIGHT-1) + 4 * (OBJECT_WIDTH-1) + 4 * (OBJECT_HEIGHT-1) + 2
+
+	def __meshCaptured(self):
+		"""
+		Builds the mesh of the captured data
 		"""
 		data = self.__capturedData
 		unitH = HORIZONTAL_PIXEL_SIZE
@@ -200,30 +237,11 @@ class Kinect:
 		depth = OBJECT_DEPTH
 		if data is None:
 			return None
-		# Function to get a point on the top surface from x and y
-		def topPoint(x, y):
-			return ((x-width/2)*unitH, (height/2-y)*unitH, (BASE_DEPTH + depth - data[y,x])*unitV)
-		# Function to get a point on the bottom surface from x and y
-		def bottomPoint(x, y):
-			return ((x-width/2)*unitH, (height/2-y)*unitH, 0)
-		# Constructs a simple square base
-		base = [(bottomPoint(0, 0), bottomPoint(0, height-1), bottomPoint(width-1, height-1), bottomPoint(width-1, 0))]
-		# Constructs the top surface
-		top = []
-		for x in range(0, width-1):
-			for y in range(0, height-1):
-				top.append((topPoint(x, y), topPoint(x+1, y), topPoint(x+1, y+1), topPoint(x, y+1)))
-		# Constructs the sides
-		sides = []
-		for x in range(0, width-1):
-				sides.append((bottomPoint(x, 0), bottomPoint((x+1), 0), topPoint(x+1, 0), topPoint(x, 0)))
-				sides.append((bottomPoint(x, height-1), bottomPoint(x+1, height-1), topPoint(x+1, height-1), topPoint(x, height-1)))
-		for y in range(0, height-1):
-				sides.append((bottomPoint(0, y), bottomPoint(0, y+1), topPoint(0, y+1), topPoint(0, y)))
-				sides.append((bottomPoint(width-1, y), bottomPoint(width-1, y+1), topPoint(width-1, y+1), topPoint(width-1, y)))
-		# Puts everything together
-		shape = base + top + sides
-		return shape
+		# Height of each point of the top surface
+		z = (BASE_DEPTH + depth - data[:height, :width].astype(numpy.int64)) * unitV
+		x = (numpy.arange(width) - width/2) * unitH
+		y = (height/2 - numpy.arange(height)) * unitH
+		return heightmapMesh(z, x, y, maxError=self.__maxError)
 
 	@property
 	def selectRatio(self):
@@ -253,31 +271,392 @@ class Kinect:
 		"""
 		return EXPORT_FILENAME
 
-	def __scaleToByte(self, depth, refDepth=None):
+	@property
+	def exportFormat(self):
 		"""
-		Scales the depth beteen 0 and 255 according to itself or the reference
+		STL format of the exported files
+		"""
+		return EXPORT_FORMAT
+
+	class KinectError(RuntimeError):
+		"""
+		Kinect-specific exception: communication is wrong
+		"""
+		def __init__(self, arg):
+			self.args = [arg]
+
+class DepthImage:
+	"""
+	Grey-scale 32 bits RGB image of depth data, for the display.
+	The pixels are looked up in a table giving the pixel of each 16-bit
+	depth for the current depth range, and written into a preallocated
+	array, which can be wrapped by a QImage without copy.
+	The table is only computed again when the range changes.
+	"""
+	def __init__(self):
+		# Image pixels, allocated for the first depth
+		self.__pixels = None
+		# Pixel of each depth and depth range of the table
+		self.__table = None
+		self.__range = None
+
+	def update(self, depth, refDepth=None):
+		"""
+		Converts the depth (16-bit values) to pixels, the grey scale
+		going from the minimum to the maximum of the reference depth
+		(the depth itself by default). Returns the pixels array,
+		which is the same for each call with the same depth shape.
 		"""
 		if refDepth is None:
 			refDepth = depth
-		minimum = numpy.amin(refDepth)
-		maximum = numpy.amax(refDepth)
-		if maximum == minimum:
-			maximum+= 1
-		depth = (depth - minimum) * 255 / (maximum - minimum)
-		depth = depth.clip(0, 255)
-		return depth
+		depthRange = (numpy.amin(refDepth), numpy.amax(refDepth))
+		if self.__range != depthRange:
+			self.__table = depthTable(*depthRange)
+			self.__range = depthRange
+		if self.__pixels is None or self.__pixels.shape != depth.shape:
+			self.__pixels = numpy.empty(depth.shape, numpy.uint32)
+		numpy.take(self.__table, depth, out=self.__pixels, mode='clip')
+		return self.__pixels
+
+def depthTable(minimum, maximum):
+	"""
+	Returns the grey-scale 32 bits RGB pixel of each 16-bit depth,
+	the grey scale going from minimum to maximum
+	"""
+	depth = numpy.arange(1 << 16, dtype=numpy.uint32)
+	if maximum == minimum:
+		maximum+= 1
+	depth = (depth - minimum) * 255 / (maximum - minimum)
+	depth = depth.clip(0, 255)
+	depth+= (depth << 8) + (depth << 16) + (255 << 24)
+	return depth
+
+class DepthAcquisition(threading.Thread):
+	"""
+	Thread reading the depth frames of a device into a TemporalFilter.
+	The filtered depth is published for takeDepth after each frame.
+	The frames are never copied between the threads: the published depth
+	is swapped between 3 buffers (the one being computed, the newest one
+	and the one taken by the reader), under a lock held only for the swap.
+	"""
+	def __init__(self, device):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.__device = device
+		# Filter of the last frames
+		self.__filter = TemporalFilter(device.shape)
+		# Depth being computed, newest depth and depth taken by the reader
+		self.__computed = numpy.zeros(device.shape, numpy.uint16)
+		self.__newest = numpy.zeros(device.shape, numpy.uint16)
+		self.__taken = numpy.zeros(device.shape, numpy.uint16)
+		self.__isNew = False
+		self.__swapLock = threading.Lock()
+		self.__stopped = threading.Event()
+		# Error that stopped the thread, if any
+		self.error = None
+
+	def run(self):
+		"""
+		Reads the frames until stopped
+		"""
+		while not self.__stopped.is_set():
+			try:
+				frame = self.__device.read()
+			except Kinect.KinectError as e:
+				self.error = e
+				return
+			except Exception as e:
+				# Reaches the interface like the communication problems
+				self.error = Kinect.KinectError(type(e).__name__ + ': ' + str(e))
+				return
+			self.__filter.add(frame, self.__computed)
+			with self.__swapLock:
+				self.__computed, self.__newest = self.__newest, self.__computed
+				self.__isNew = True
+
+	def takeDepth(self):
+		"""
+		Returns the newest filtered depth, or None if there is no new one.
+		The returned array stays valid until the next call, it is then
+		given back to the thread: copy it to keep it longer.
+		"""
+		with self.__swapLock:
+			if not self.__isNew:
+				return None
+			self.__taken, self.__newest = self.__newest, self.__taken
+			self.__isNew = False
+		return self.__taken
 
-	def __depthToRGB(self, depth):
+	def stop(self):
 		"""
-		Transforms values between 0 and 255 to
-		gray-scale RGB pixels
+		Stops reading the frames and waits for the thread
 		"""
-		depth+= (depth << 8) + (depth << 16) + (255 << 24)
-		return depth
+		self.__stopped.set()
+		self.join()
 
-	class KinectError(RuntimeError):
+class TemporalFilter:
+	"""
+	Sliding window filter of depth frames, giving a result for each frame.
+	The last frames are kept in a ring buffer, and all the computations
+	are done in preallocated arrays, so the memory used is constant.
+	"""
+	def __init__(self, shape, window=None, mode=None):
+		"""
+		Filters frames of the given shape over window frames
+		(AVERAGE_WINDOW by default) with the mode 'min', 'median'
+		or 'mean' (DEPTH_FILTER by default)
+		"""
+		if window is None:
+			window = AVERAGE_WINDOW
+		if mode is None:
+			mode = DEPTH_FILTER
+		if mode not in ('min', 'median', 'mean'):
+			raise ValueError('unknown depth filter: ' + str(mode))
+		self.mode = mode
+		self.window = window
+		self.__count = 0
+		# Ring buffer of the last frames, unknown until filled
+		self.__frames = numpy.empty((window,) + tuple(shape), numpy.uint16)
+		self.__frames.fill(UNKNOWN_DEPTH)
+		pixels = self.__frames[0].size
+		if mode == 'mean':
+			# Sum and number of the known values of each pixel
+			self.__sum = numpy.zeros(shape, numpy.uint32)
+			self.__known = numpy.zeros(shape, numpy.uint8)
+			self.__mask = numpy.empty(shape, numpy.bool_)
+			self.__divisor = numpy.empty(shape, numpy.uint8)
+		if mode == 'median':
+			# Sorted copy of the frames, index of the median of each pixel
+			self.__sorted = numpy.empty_like(self.__frames)
+			self.__knownFrames = numpy.empty(self.__frames.shape, numpy.bool_)
+			self.__knownCount = numpy.empty(shape, numpy.intp)
+			self.__index = numpy.empty(pixels, numpy.intp)
+			self.__offsets = numpy.arange(pixels)
+
+	def add(self, frame, out):
+		"""
+		Adds a frame and writes the filtered depth of the window into out
+		(uint16 array of the frame shape)
+		"""
+		slot = self.__frames[self.__count % self.window]
+		self.__count+= 1
+		if self.mode == 'mean':
+			# Remove the oldest known values, add the new ones
+			numpy.not_equal(slot, UNKNOWN_DEPTH, out=self.__mask)
+			numpy.subtract(self.__sum, slot, out=self.__sum, where=self.__mask)
+			numpy.subtract(self.__known, 1, out=self.__known, where=self.__mask)
+			numpy.not_equal(frame, UNKNOWN_DEPTH, out=self.__mask)
+			numpy.add(self.__sum, frame, out=self.__sum, where=self.__mask)
+			numpy.add(self.__known, 1, out=self.__known, where=self.__mask)
+			slot[...] = frame
+			numpy.maximum(self.__known, 1, out=self.__divisor)
+			numpy.floor_divide(self.__sum, self.__divisor, out=out, casting='unsafe')
+			numpy.equal(self.__known, 0, out=self.__mask)
+			numpy.copyto(out, UNKNOWN_DEPTH, where=self.__mask)
+			return
+		slot[...] = frame
+		if self.mode == 'min':
+			# The unknown value is the highest, so it is only kept if no value is known
+			numpy.minimum.reduce(self.__frames, axis=0, out=out)
+			return
+		# Median of the known values: they are sorted before the unknown ones,
+		# which are all that is left to take when no value is known
+		self.__sorted[...] = self.__frames
+		self.__sorted.sort(axis=0)
+		numpy.not_equal(self.__frames, UNKNOWN_DEPTH, out=self.__knownFrames)
+		numpy.sum(self.__knownFrames, axis=0, out=self.__knownCount)
+		numpy.subtract(self.__knownCount, 1, out=self.__knownCount)
+		numpy.floor_divide(self.__knownCount, 2, out=self.__knownCount)
+		numpy.maximum(self.__knownCount, 0, out=self.__knownCount)
+		numpy.multiply(self.__knownCount.reshape(-1), self.__offsets.size, out=self.__index)
+		numpy.add(self.__index, self.__offsets, out=self.__index)
+		numpy.take(self.__sorted.reshape(-1), self.__index, out=out.reshape(-1))
+
+def createDevice():
+	"""
+	Creates the depth device chosen by DEVICE
+	"""
+	if DEVICE == 'freenect':
+		return FreenectDevice()
+	if DEVICE == 'fake':
+		return FakeDevice()
+	raise ValueError('unknown depth device: ' + str(DEVICE))
+
+class FreenectDevice:
+	"""
+	Depth frames of the Kinect, read with freenect
+	"""
+	# Size of the frames (rows, columns)
+	shape = (480, 640)
+
+	def read(self):
 		"""
-		Kinect-specific exception: communication is wrong
+		Waits for the next depth frame and returns it (numpy 16-bit array).
+		Raises a Kinect.KinectError if there are communication problems with the Kinect
 		"""
-		def __init__(self, arg):
-			self.args = [arg]
\ No newline at end of file
+		if freenect is None:
+			raise Kinect.KinectError("freenect is not installed")
+		response = freenect.sync_get_depth()
+		if response is None:
+			raise Kinect.KinectError("not replying")
+		return response[0]
+
+class FakeDevice:
+	"""
+	Synthetic depth frames, to run and test without a Kinect:
+	a head moving slowly in front of a wall, with noise and
+	unknown points (2047) like the Kinect, at FAKE_FRAME_RATE
+	"""
+	# Size of the frames (rows, columns)
+	shape = (480, 640)
+
+	def __init__(self, seed=0, frameRate=None):
+		if frameRate is None:
+			frameRate = FAKE_FRAME_RATE
+		self.__period = 1.0 / frameRate if frameRate else 0
+		self.__random = numpy.random.RandomState(seed)
+		self.__frameCount = 0
+		self.__nextTime = None
+		self.__y, self.__x = numpy.mgrid[0:self.shape[0], 0:self.shape[1]]
+		self.__frame = numpy.empty(self.shape, numpy.uint16)
+
+	def read(self):
+		"""
+		Returns the next depth frame (numpy 16-bit array),
+		at the frame rate of the device.
+		The array is reused by the next call.
+		"""
+		if self.__period:
+			now = time.time()
+			if self.__nextTime is None:
+				self.__nextTime = now
+			if self.__nextTime > now:
+				time.sleep(self.__nextTime - now)
+			self.__nextTime+= self.__period
+		centerX = 320 + 40 * numpy.sin(self.__frameCount / 50.0)
+		self.__frameCount+= 1
+		# Head as an ellipsoid in front of the wall
+		head = 1 - ((self.__x - centerX) / 110.0)**2 - ((self.__y - 240) / 150.0)**2
+		depth = 900 - 150 * numpy.sqrt(head.clip(0, 1))
+		depth+= self.__random.normal(0, 1, self.shape)
+		self.__frame[...] = depth
+		self.__frame[self.__random.rand(*self.shape) < 0.02] = 2047
+		return self.__frame
+
+def interpolateHoles(data):
+	"""
+	Takes a 2D array with values from 0 to 255.
+	Interpolates to replace values equal to 255
+	if they are in holes, along each row and along each column
+	(average of both when a value is in both).
+	Gives exactly the same result as interpolateHolesReference.
+	"""
+	data = numpy.asarray(data)
+	rowValues, rowFilled = interpolateRows(data)
+	columnValues, columnFilled = interpolateRows(data.T)
+	columnValues, columnFilled = columnValues.T, columnFilled.T
+	fixedData = data.copy()
+	fixedData[rowFilled] = rowValues[rowFilled]
+	fixedData[columnFilled & ~rowFilled] = columnValues[columnFilled & ~rowFilled]
+	both = rowFilled & columnFilled
+	fixedData[both] = (rowValues[both] + columnValues[both]) // 2
+	return fixedData
+
+def interpolateRows(data):
+	"""
+	Linear interpolation of the holes of each row of a 2D array,
+	by runs of HOLE_VALUE found with cumulative indices.
+	A hole is filled if it is shorter than MAX_HOLE_LENGTH
+	and has a known value on both sides. As in the reference,
+	the value before a hole is the last known value that does
+	not follow another hole, and the results are rounded down.
+	Returns a tuple (interpolated values, mask of the filled values)
+	"""
+	rows, columns = data.shape
+	hole = data == HOLE_VALUE
+	positions = numpy.arange(columns)
+	previousHole = numpy.zeros_like(hole)
+	previousHole[:, 1:] = hole[:, :-1]
+	nextHole = numpy.ones_like(hole)
+	nextHole[:, :-1] = hole[:, 1:]
+	# First and last positions of the hole of each value
+	holeStart = numpy.maximum.accumulate(numpy.where(hole & ~previousHole, positions, -1), axis=1)
+	holeEnd = numpy.minimum.accumulate(numpy.where(hole & ~nextHole, positions, columns)[:, ::-1], axis=1)[:, ::-1]
+	# Known values that are not just after a hole are the values before holes
+	lastBefore = numpy.maximum.accumulate(numpy.where(~hole & ~previousHole, positions, -1), axis=1)
+	before = numpy.full(hole.shape, -1, numpy.intp)
+	inside = hole & (holeStart > 0)
+	rowIndex = numpy.arange(rows)[:, numpy.newaxis] * columns
+	before[inside] = lastBefore.ravel()[(rowIndex + holeStart - 1)[inside]]
+	filled = inside & (before >= 0) & (holeEnd < columns - 1) & (holeEnd - holeStart < MAX_HOLE_LENGTH)
+	values = numpy.zeros(hole.shape, numpy.int64)
+	flatData = data.ravel().astype(numpy.int64)
+	beforeValue = flatData[(rowIndex + before)[filled]]
+	afterValue = flatData[(rowIndex + holeEnd + 1)[filled]]
+	step = (positions - holeStart + 1)[filled]
+	length = (holeEnd - holeStart + 2)[filled]
+	values[filled] = beforeValue + ((afterValue - beforeValue) * step) // length
+	return (values, filled)
+
+def compareInterpolation(data):
+	"""
+	Returns True if interpolateHoles and interpolateHolesReference
+	give exactly the same result for a 2D array
+	"""
+	return numpy.array_equal(interpolateHoles(data), interpolateHolesReference(data))
+
+def interpolateHolesReference(data):
+	"""
+	Reference implementation of interpolateHoles,
+	filling the holes one value at a time.
+	"""
+	fixedData = data.copy()
+	width = data.shape[0]
+	height = data.shape[1]
+	for x in range(0, width):
+		# Vertical interpolation
+		gapStart = None
+		gapEnd = None
+		beforeVal = None
+		afterVal = None
+		for y in range(0, height):
+			val = data[x,y]
+			if val != 255:
+				if gapStart is not None:
+					gapEnd = y - 1
+					afterVal = val
+					if beforeVal is not None and gapEnd - gapStart < 20:
+						for modY in range(gapStart, gapEnd+1):
+							fixedData[x,modY] = beforeVal + ((int(afterVal) - beforeVal) * (modY + 1 - gapStart)) / (gapEnd + 2 - gapStart)
+					gapStart = None
+					gapEnd = None
+				else:
+					beforeVal = val
+			elif gapStart is None:
+				gapStart = y
+	for y in range(0, height):
+		# Horizontal interpolation
+		gapStart = None
+		gapEnd = None
+		beforeVal = None
+		afterVal = None
+		for x in range(0, width):
+			val = data[x,y]
+			if val != 255:
+				if gapStart is not None:
+					gapEnd = x - 1
+					afterVal = val
+					if beforeVal is not None and gapEnd - gapStart < 20:
+						for modX in range(gapStart, gapEnd+1):
+							newVal = beforeVal + ((int(afterVal) - beforeVal) * (modX + 1 - gapStart)) / (gapEnd + 2 - gapStart)
+							if fixedData[modX,y] == 255:
+								fixedData[modX,y] = newVal
+							else:
+								fixedData[modX,y] = (fixedData[modX,y] + newVal) / 2
+					gapStart = None
+					gapEnd = None
+				else:
+					beforeVal = val
+			elif gapStart is None:
+				gapStart = x
+	return fixedData
@@ -1,11 +1,14 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*- 
-from PyQt4 import QtGui
+from PyQt4 import QtGui, QtCore
 import sys
 import os.path
 from kinect import Kinect
 from preview import Preview
-from stl_writer import ASCIISTLWriter as STLWriter
+from stl_writer import WRITERS as STL_WRITERS
+
+# Number of triangles written between two progress updates of the export
+EXPORT_CHUNK = 8192
 
 class Photomaton(QtGui.QMainWindow):
 	"""
@@ -20,16 +23,21 @@ class Photomaton(QtGui.QMainWindow):
 		self.__kinect = Kinect() # This contains all the logic
 		self.__objectData = None # Keep this to avoid refresh issues on the image
 		self.__exportDirectory = os.path.expanduser('~') # Save directory
+		self.__worker = None # Capture or export running in the background
 		# Initialize the UI
 		self.__mainWidget = None
 		self.__previewImage = None
 		self.__objectImage = None
 		self.__captureButton = None
 		self.__exportButton = None
+		self.__errorInput = None
+		self.__trianglesLabel = None
+		self.__progressBar = None
 		self.__initUI()
 		# Events
 		self.__captureButton.clicked.connect(self.__onCapture)
 		self.__exportButton.clicked.connect(self.__onExport)
+		self.__errorInput.valueChanged.connect(self.__onErrorChange)
 
 	def __initUI(self):
 		"""
@@ -54,10 +62,28 @@ class Photomaton(QtGui.QMainWindow):
 		vLayout.addWidget(QtGui.QLabel(u"Objet à imprimer :"))
 		vLayout.addWidget(self.__objectImage)
 		vLayout.addStretch(1)
+		# Maximum vertical error input (0 = no simplification)
+		self.__errorInput = QtGui.QDoubleSpinBox()
+		self.__errorInput.setDecimals(2)
+		self.__errorInput.setMinimum(0)
+		self.__errorInput.setMaximum(10)
+		self.__errorInput.setSingleStep(0.05)
+		self.__errorInput.setValue(self.__kinect.maxError or 0)
+		hLayout = QtGui.QHBoxLayout()
+		hLayout.addWidget(QtGui.QLabel(u"Erreur verticale max (mm) :"))
+		hLayout.addStretch(1)
+		hLayout.addWidget(self.__errorInput)
+		vLayout.addLayout(hLayout)
+		self.__trianglesLabel = QtGui.QLabel()
+		vLayout.addWidget(self.__trianglesLabel)
 		self.__captureButton = QtGui.QPushButton(u"Photographier")
 		vLayout.addWidget(self.__captureButton)
 		self.__exportButton = QtGui.QPushButton(u"Exporter")
 		vLayout.addWidget(self.__exportButton)
+		self.__progressBar = QtGui.QProgressBar()
+		self.__progressBar.setRange(0, 100)
+		self.__progressBar.setVisible(False)
+		vLayout.addWidget(self.__progressBar)
 		layout.addLayout(vLayout)
 		self.__refreshObjectImage()
 
@@ -68,6 +94,13 @@ class Photomaton(QtGui.QMainWindow):
         # Title
 		self.setWindowTitle("Photomaton")
 
+	def closeEvent(self, event):
+		"""
+		Stops the Kinect acquisition when the window is closed
+		"""
+		self.__kinect.stop()
+		QtGui.QMainWindow.closeEvent(self, event)
+
 	def __refreshObjectImage(self):
 		"""
 		Refresh the object image
@@ -77,8 +110,9 @@ class Photomaton(QtGui.QMainWindow):
 		data = self.__kinect.rgb32Captured
 		image = None
 		if data is not None:
-			self.__objectData = data.tostring()
-			image = QtGui.QImage(self.__objectData, width, height, QtGui.QImage.Format_RGB32)
+			# The image uses the pixels of the Kinect without copy
+			self.__objectData = data
+			image = QtGui.QImage(data.data, width, height, QtGui.QImage.Format_RGB32)
 		else:
 			image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
 			image.fill(0)
@@ -88,8 +122,64 @@ class Photomaton(QtGui.QMainWindow):
 		"""
 		Capture the image from the camera
 		"""
-		self.__kinect.capture()
+		# The depth is copied here, the preview goes on reading the next ones
+		self.__startWorker(CaptureWorker(self.__kinect, self.__kinect.captureDepth()), self.__onCaptureDone)
+
+	def __onCaptureDone(self, error):
+		"""
+		The capture and its mesh are ready
+		"""
+		self.__stopWorker()
 		self.__refreshObjectImage()
+		if error:
+			# The mesh would be built again in the interface
+			self.__trianglesLabel.setText(u"")
+			QtGui.QMessageBox.critical(self, u"Capture impossible", u"L'image n'a pas pu être capturée : " + error)
+			return
+		self.__refreshTriangleCount()
+
+	def __onErrorChange(self, value):
+		"""
+		Change the maximum vertical error of the mesh
+		"""
+		self.__kinect.setMaxError(value if value > 0 else None)
+		self.__startWorker(CaptureWorker(self.__kinect), self.__onCaptureDone)
+
+	def __startWorker(self, worker, done):
+		"""
+		Runs a worker in the background, the live preview goes on
+		but the capture and export controls are disabled
+		"""
+		self.__captureButton.setEnabled(False)
+		self.__exportButton.setEnabled(False)
+		self.__errorInput.setEnabled(False)
+		self.__progressBar.setValue(0)
+		self.__progressBar.setVisible(True)
+		self.__worker = worker
+		self.__worker.progress.connect(self.__progressBar.setValue)
+		self.__worker.finished.connect(done)
+		self.__worker.start()
+
+	def __stopWorker(self):
+		"""
+		The background worker is finished
+		"""
+		self.__worker.wait()
+		self.__worker = None
+		self.__progressBar.setVisible(False)
+		self.__captureButton.setEnabled(True)
+		self.__exportButton.setEnabled(True)
+		self.__errorInput.setEnabled(True)
+
+	def __refreshTriangleCount(self):
+		"""
+		Shows the number of triangles of the mesh, before and after simplification
+		"""
+		shape = self.__kinect.stlCaptured
+		if shape is None:
+			self.__trianglesLabel.setText(u"")
+			return
+		self.__trianglesLabel.setText(u"Triangles : " + str(len(shape)) + u" (" + str(self.__kinect.gridTriangleCount) + u" avant simplification)")
 
 	def __onExport(self):
 		"""
@@ -108,14 +198,94 @@ class Photomaton(QtGui.QMainWindow):
 		if shape is None:
 			QtGui.QMessageBox.warning(self, u"Pas de capture", u"Capturez une image avant de l'exporter.")
 			return
-		# Writes the STL file
-		with open(filename, 'w') as fp:
-			writer = STLWriter(fp)
-			writer.add_faces(shape)
-			writer.close()
+		# Writes the STL file in the background
+		self.__startWorker(ExportWorker(filename, shape, self.__kinect.exportFormat), self.__onExportDone)
+
+	def __onExportDone(self, error):
+		"""
+		The STL file is written
+		"""
+		self.__stopWorker()
+		if error:
+			QtGui.QMessageBox.critical(self, u"Export impossible", u"Le fichier n'a pas pu être écrit : " + error)
+			return
 		# Confirm
 		QtGui.QMessageBox.information(self, u"Modèle 3D prêt", u"Le modèle 3D a été exporté, il ne reste plus qu'à l'imprimer.")
 
+class CaptureWorker(QtCore.QThread):
+	"""
+	Worker that captures the Kinect data and builds its mesh in the background
+	"""
+
+	# Progress signal (percentage)
+	progress = QtCore.pyqtSignal(int, name="progress")
+	# Finished signal (error message, empty if none)
+	finished = QtCore.pyqtSignal(unicode, name="finished")
+
+	def __init__(self, kinect, depth=None):
+		"""
+		Gets the parameters, the depth to capture (see Kinect.captureDepth),
+		without depth only the mesh is built
+		"""
+		super(CaptureWorker, self).__init__()
+		self.__kinect = kinect
+		self.__depth = depth
+
+	def run(self):
+		"""
+		Runs the function
+		"""
+		try:
+			if self.__depth is not None:
+				self.__kinect.capture(self.__depth)
+				self.progress.emit(50)
+			self.__kinect.stlCaptured
+		except Exception as e:
+			self.finished.emit(unicode(e))
+			return
+		self.progress.emit(100)
+		self.finished.emit(u"")
+
+class ExportWorker(QtCore.QThread):
+	"""
+	Worker that writes a mesh to an STL file in the background
+	"""
+
+	# Progress signal (percentage)
+	progress = QtCore.pyqtSignal(int, name="progress")
+	# Finished signal (error message, empty if none)
+	finished = QtCore.pyqtSignal(unicode, name="finished")
+
+	def __init__(self, filename, shape, stlFormat):
+		"""
+		Gets the parameters
+		"""
+		super(ExportWorker, self).__init__()
+		self.__filename = filename
+		self.__shape = shape
+		self.__stlFormat = stlFormat
+
+	def run(self):
+		"""
+		Runs the function
+		"""
+		count = len(self.__shape)
+		try:
+			with open(self.__filename, 'wb') as fp:
+				writer = STL_WRITERS[self.__stlFormat](fp)
+				for start in range(0, count, EXPORT_CHUNK):
+					stop = min(start + EXPORT_CHUNK, count)
+					writer.add_triangles(self.__shape.triangleArray(start, stop))
+					self.progress.emit(100 * stop / count)
+				writer.close()
+		except (IOError, OSError) as e:
+			self.finished.emit(unicode(e.strerror or e))
+			return
+		except Exception as e:
+			self.finished.emit(unicode(e))
+			return
+		self.finished.emit(u"")
+
 
 def main():
     """
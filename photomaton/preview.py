@@ -134,11 +134,14 @@ class Preview(QtGui.QLabel):
 		if self.__selectRect is None:
 			self.__selectRect = ([0, 0], [self.__width, self.__height])
 			self.__normalizeRect()
-		self.__imageData = data.tostring()
-		image = QtGui.QImage(self.__imageData, self.__width, self.__height, QtGui.QImage.Format_RGB32)
+		# The image uses the pixels of the Kinect without copy,
+		# the rectangle is drawn on the pixmap to leave them unchanged
+		self.__imageData = data
+		image = QtGui.QImage(data.data, self.__width, self.__height, QtGui.QImage.Format_RGB32)
+		pixmap = QtGui.QPixmap.fromImage(image)
 		painter = QtGui.QPainter()
-		painter.begin(image)
+		painter.begin(pixmap)
 		painter.setPen(QtGui.QPen(QtGui.QColor(0, 100, 200), 3))
 		painter.drawRect(self.__selectRect[0][0], self.__selectRect[0][1], self.__selectRect[1][0], self.__selectRect[1][1])
 		painter.end()
-		self.setPixmap(QtGui.QPixmap.fromImage(image))
\ No newline at end of file
+		self.setPixmap(pixmap)
\ No newline at end of file
@@ -1,10 +1,14 @@
+## {{{ http://code.activestate.com/recipes/578246/ (r1)
 #!/usr/bin/env python
-# coding:utf-8
+#coding:utf-8
 # Purpose: Export 3D objects, build of faces with 3 or 4 vertices, as ASCII or Binary STL file.
 # License: MIT License
-# http://code.activestate.com/recipes/578246/
 
 import struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 ASCII_FACET = """facet normal 0 0 0
 outer loop
@@ -15,9 +19,33 @@ endloop
 endfacet
 """
 
+# Same facet, for printf-style formatting of many facets at once
+ASCII_FACET_PRINTF = """facet normal 0 0 0
+outer loop
+vertex %.4f %.4f %.4f
+vertex %.4f %.4f %.4f
+vertex %.4f %.4f %.4f
+endloop
+endfacet
+"""
+
+# Number of triangles formatted and written at once by the ASCII writer
+ASCII_CHUNK = 4096
+
+# Number of triangles of a mesh gathered and written at once
+MESH_CHUNK = 1 << 16
+
 BINARY_HEADER ="80sI"
 BINARY_FACET = "12fH"
 
+# One binary STL record (normal, 3 vertices, attribute), 50 bytes
+if numpy is not None:
+    BINARY_RECORD = numpy.dtype([
+        ('normal', '<f4', (3,)),
+        ('vertices', '<f4', (3, 3)),
+        ('attribute', '<u2'),
+    ])
+
 class ASCIISTLWriter:
     """ Export 3D objects build of 3 or 4 vertices as ASCII STL file.
     """
@@ -50,17 +78,63 @@ class ASCIISTLWriter:
             raise ValueError('only 3 or 4 vertices for each face')
 
     def add_faces(self, faces):
-        """ Add many faces. """
-        for face in faces:
-            self.add_face(face)
+        """ Add many faces, all at once if they have the same
+        number of vertices (requires numpy). faces may be a mesh,
+        see add_mesh. """
+        if hasattr(faces, 'triangleArray'):
+            return self.add_mesh(faces)
+        faces = list(faces)
+        array = self._face_array(faces)
+        if array is None:
+            for face in faces:
+                self.add_face(face)
+            return
+        if array.shape[1] == 4:
+            # Same split as _split: (p1, p2, p3), (p3, p4, p1)
+            array = array[:, [0, 1, 2, 2, 3, 0]]
+        self.add_triangles(array)
+
+    def add_triangles(self, triangles):
+        """ Add many triangles, given as an (N, 3, 3) array.
+        With numpy, ASCII_CHUNK triangles are formatted with
+        a single printf-style operation and written at once. """
+        if numpy is None:
+            for triangle in triangles:
+                self._write(triangle)
+            return
+        triangles = numpy.asarray(triangles, numpy.float64).reshape(-1, 9)
+        for start in range(0, len(triangles), ASCII_CHUNK):
+            chunk = triangles[start:start + ASCII_CHUNK]
+            self.fp.write((ASCII_FACET_PRINTF * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+    def add_mesh(self, mesh):
+        """ Add all the triangles of a mesh (a mesh.Mesh, or any object
+        with a length and a triangleArray(start, stop) method giving
+        (N, 3, 3) arrays), by chunks of MESH_CHUNK. """
+        for start in range(0, len(mesh), MESH_CHUNK):
+            self.add_triangles(mesh.triangleArray(start, start + MESH_CHUNK))
+
+    def _face_array(self, faces):
+        """ Returns the faces as an (N, 3 or 4, 3) float64 array,
+        or None if numpy is missing or the faces are mixed. """
+        if numpy is None:
+            return None
+        try:
+            array = numpy.asarray(faces, numpy.float64)
+        except ValueError:
+            return None
+        if array.ndim != 3 or array.shape[1] not in (3, 4) or array.shape[2] != 3:
+            return None
+        return array
 
 class BinarySTLWriter(ASCIISTLWriter):
-    """
-    Export 3D objects build of 3 or 4 vertices as binary STL file.
+    """ Export 3D objects build of 3 or 4 vertices as binary STL file.
+    The stream must be seekable: the triangle count is written
+    in the header when closing.
     """
     def __init__(self, stream):
         self.counter = 0
-        super(Binary_STL_Writer, self).__init__(stream)
+        ASCIISTLWriter.__init__(self, stream)
 
     def close(self):
         self._write_header()
@@ -72,10 +146,33 @@ class BinarySTLWriter(ASCIISTLWriter):
     def _write(self, face):
         self.counter += 1
         data = [
-        0., 0., 0.,
-        face[0][0], face[0][1], face[0][2],
-        face[1][0], face[1][1], face[1][2],
-        face[2][0], face[2][1], face[2][2],
-        0
+            0., 0., 0.,
+            face[0][0], face[0][1], face[0][2],
+            face[1][0], face[1][1], face[1][2],
+            face[2][0], face[2][1], face[2][2],
+            0
         ]
-        self.fp.write(struct.pack(BINARY_FACET, *data))
\ No newline at end of file
+        self.fp.write(struct.pack(BINARY_FACET, *data))
+
+    def add_triangles(self, triangles):
+        """ Add many triangles, given as an (N, 3, 3) float32 array,
+        with a single write. """
+        if numpy is None:
+            for triangle in triangles:
+                self._write(triangle)
+            return
+        triangles = numpy.asarray(triangles, numpy.float32).reshape(-1, 3, 3)
+        records = numpy.zeros(len(triangles), BINARY_RECORD)
+        records['vertices'] = triangles
+        self.fp.write(records.tobytes())
+        self.counter += len(records)
+
+# Writer classes by format name
+WRITERS = {
+    'ascii': ASCIISTLWriter,
+    'binary': BinarySTLWriter,
+}
+
+
+
+## end of http://code.activestate.com/recipes/578246/ }}}
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Tests of the image parsing of the extruder
+"""
+from PIL import Image
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import extruder
+
+class ParseTest(unittest.TestCase):
+	"""
+	Parses images written in a temporary directory, without the disk cache
+	"""
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.diskCache = extruder.DISK_CACHE_DIRECTORY
+		extruder.DISK_CACHE_DIRECTORY = None
+
+	def tearDown(self):
+		extruder.DISK_CACHE_DIRECTORY = self.diskCache
+		extruder.ANALYSIS_CACHE.clear()
+		shutil.rmtree(self.directory)
+
+	def imageFile(self, data, name='image.png'):
+		"""
+		Saves an RGB array as a PNG file, returns its path
+		"""
+		path = os.path.join(self.directory, name)
+		Image.fromarray(numpy.asarray(data, numpy.uint8), 'RGB').save(path)
+		return path
+
+	def greenScreen(self, width, height, seed=0):
+		"""
+		Returns a noisy RGB array of a head and shoulders on a green background
+		"""
+		random = numpy.random.RandomState(seed)
+		y, x = numpy.mgrid[0:height, 0:width]
+		data = numpy.empty((height, width, 3))
+		data[:, :] = (40, 180, 60)
+		data[((x - 0.5*width) / (0.15*width))**2 + ((y - 0.35*height) / (0.2*height))**2 < 1] = (220, 170, 140)
+		data[((x - 0.5*width) / (0.3*width))**2 + ((y - height) / (0.4*height))**2 < 1] = (60, 60, 140)
+		data+= random.normal(0, 8, data.shape)
+		return data.clip(0, 255)
+
+class EnginesTest(ParseTest):
+	"""
+	The numpy engine gives the same result as the python engine
+	"""
+	def assertSameEngines(self, path, threshold=None, size=20):
+		if threshold is None:
+			threshold = extruder.COLOR_THRESHOLD
+		self.assertTrue(extruder.compareEngines(path, threshold, size))
+
+	def testGreenScreen(self):
+		path = self.imageFile(self.greenScreen(60, 40))
+		for threshold in (10, extruder.COLOR_THRESHOLD, 150):
+			for size in (7, 20, 64):
+				self.assertSameEngines(path, threshold, size)
+
+	def testRandom(self):
+		random = numpy.random.RandomState(1)
+		for i in range(0, 5):
+			height, width = random.randint(1, 30, 2)
+			data = random.randint(0, 256, (height, width, 3))
+			self.assertSameEngines(self.imageFile(data, str(i) + '.png'), random.randint(1, 200))
+
+	def testEdges(self):
+		uniform = numpy.zeros((20, 30, 3))
+		uniform[:, :] = (40, 180, 60)
+		self.assertSameEngines(self.imageFile(uniform, 'uniform.png'))
+		dot = uniform.copy()
+		dot[7, 11] = (255, 0, 0)
+		self.assertSameEngines(self.imageFile(dot, 'dot.png'))
+		self.assertSameEngines(self.imageFile(numpy.zeros((1, 1, 3)), 'pixel.png'))
+		self.assertSameEngines(self.imageFile(numpy.arange(90).reshape(1, 30, 3) * 2, 'row.png'))
+
+class TilesTest(ParseTest):
+	"""
+	The analysis shared between processes (PARSE_PROCESSES) gives
+	the same result as the analysis in a single process
+	"""
+	SETTINGS = ('PARSE_PROCESSES', 'PARALLEL_MIN_PIXELS', 'BACKGROUND_SAMPLE', 'BACKGROUND_SAMPLING',
+		'BOUNDING_BOX_SEARCH', 'REUSE_BACKGROUND_MASK', 'MAP_RAW_IMAGES')
+
+	def setUp(self):
+		ParseTest.setUp(self)
+		self.settings = dict((name, getattr(extruder, name)) for name in self.SETTINGS)
+		extruder.PARALLEL_MIN_PIXELS = 1
+
+	def tearDown(self):
+		for name, value in self.settings.items():
+			setattr(extruder, name, value)
+		ParseTest.tearDown(self)
+
+	def parse(self, path, processes):
+		extruder.PARSE_PROCESSES = processes
+		extruder.ANALYSIS_CACHE.clear()
+		img, color, rate = extruder.parseImageNumpy(path, extruder.COLOR_THRESHOLD, 40)
+		return (img.tobytes(), list(color), rate)
+
+	def assertSameTiles(self, path):
+		for sample in (None, 5000):
+			for sampling in ('strided', 'random'):
+				for search in ('edges', 'projection'):
+					for reuseMask in (False, True):
+						extruder.BACKGROUND_SAMPLE = sample
+						extruder.BACKGROUND_SAMPLING = sampling
+						extruder.BOUNDING_BOX_SEARCH = search
+						extruder.REUSE_BACKGROUND_MASK = reuseMask
+						self.assertEqual(self.parse(path, 1), self.parse(path, 2),
+							(sample, sampling, search, reuseMask))
+
+	def testDecoded(self):
+		self.assertSameTiles(self.imageFile(self.greenScreen(120, 90)))
+
+	def testMapped(self):
+		# The processes map the file instead of sharing a copy
+		extruder.MAP_RAW_IMAGES = True
+		path = self.imageFile(self.greenScreen(120, 90), 'image.ppm')
+		self.assertTrue(isinstance(extruder.loadImage(path), numpy.memmap))
+		self.assertSameTiles(path)
+
+class DraftTest(ParseTest):
+	"""
+	The draft of an image without a draft mode is reduced from its
+	decoded pixels, like a box resize of the image
+	"""
+	def testBlockMeans(self):
+		data = numpy.asarray(self.greenScreen(103, 78), numpy.uint8)
+		for factor in (2, 3, 4):
+			reducedSize = (103 // factor, 78 // factor)
+			box = numpy.asarray(Image.fromarray(data[:78 // factor * factor, :103 // factor * factor]).resize(reducedSize, Image.BOX))
+			means = extruder.blockMeans(data, factor)
+			self.assertEqual(means.shape, box.shape)
+			self.assertTrue(numpy.abs(means.astype(int) - box).max() <= 1, factor)
+
+	def testNoDecode(self):
+		data = numpy.asarray(self.greenScreen(64, 48), numpy.uint8)
+		path = self.imageFile(data)
+		self.assertTrue((extruder.openDraft(path, 4, data) == extruder.blockMeans(data, 4)).all())
+		self.assertTrue(numpy.abs(extruder.openDraft(path, 4).astype(int) - extruder.blockMeans(data, 4)).max() <= 1)
+
+if __name__ == '__main__':
+	unittest.main()
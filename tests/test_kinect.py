@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Tests of the Kinect data processing of the photomaton
+"""
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'photomaton'))
+try:
+	import scipy.misc
+except ImportError:
+	# Only used by the capture, which is not tested here
+	scipy = types.ModuleType('scipy')
+	scipy.misc = types.ModuleType('scipy.misc')
+	sys.modules['scipy'] = scipy
+	sys.modules['scipy.misc'] = scipy.misc
+import kinect
+
+class InterpolationTest(unittest.TestCase):
+	"""
+	interpolateHoles gives the same result as interpolateHolesReference
+	"""
+	def assertSameInterpolation(self, data):
+		self.assertTrue(kinect.compareInterpolation(data), 'different interpolation of\n' + str(data))
+
+	def testRandom(self):
+		random = numpy.random.RandomState(0)
+		for i in range(0, 200):
+			shape = tuple(random.randint(1, 30, 2))
+			data = random.randint(0, 255, shape)
+			data[random.rand(*shape) < random.rand()] = kinect.HOLE_VALUE
+			self.assertSameInterpolation(data.astype(numpy.uint32))
+
+	def testLongHoles(self):
+		random = numpy.random.RandomState(1)
+		for length in (kinect.MAX_HOLE_LENGTH - 1, kinect.MAX_HOLE_LENGTH, kinect.MAX_HOLE_LENGTH + 1, 3 * kinect.MAX_HOLE_LENGTH):
+			data = random.randint(0, 255, (40, 4 * kinect.MAX_HOLE_LENGTH))
+			data[5, 3:3+length] = kinect.HOLE_VALUE
+			data[3:3+length, 7] = kinect.HOLE_VALUE
+			data[20:20+length, 10:10+length] = kinect.HOLE_VALUE
+			self.assertSameInterpolation(data)
+
+	def testEdges(self):
+		random = numpy.random.RandomState(2)
+		for shape in ((1, 1), (1, 30), (30, 1), (2, 2)):
+			for holeRate in (0, 0.3, 1):
+				data = random.randint(0, 255, shape)
+				data[random.rand(*shape) < holeRate] = kinect.HOLE_VALUE
+				self.assertSameInterpolation(data)
+		# Holes touching the borders
+		data = random.randint(0, 255, (10, 10))
+		data[0, :4] = kinect.HOLE_VALUE
+		data[-3:, -1] = kinect.HOLE_VALUE
+		self.assertSameInterpolation(data)
+
+	def testTypes(self):
+		random = numpy.random.RandomState(3)
+		data = random.randint(0, 256, (25, 25))
+		for dtype in (numpy.uint8, numpy.uint32, numpy.int64):
+			self.assertSameInterpolation(data.astype(dtype))
+
+class TemporalFilterTest(unittest.TestCase):
+	"""
+	The filter gives the reduction of the known values of each pixel
+	over the last frames, the unknown ones (2047) being ignored
+	"""
+	def expected(self, window, mode):
+		"""
+		Filter of the frames of window computed pixel by pixel
+		"""
+		result = numpy.empty(window.shape[1:], numpy.uint16)
+		for y in range(window.shape[1]):
+			for x in range(window.shape[2]):
+				values = sorted(value for value in window[:, y, x] if value != kinect.UNKNOWN_DEPTH)
+				if not values:
+					result[y, x] = kinect.UNKNOWN_DEPTH
+				elif mode == 'min':
+					result[y, x] = values[0]
+				elif mode == 'median':
+					result[y, x] = values[(len(values) - 1) // 2]
+				else:
+					result[y, x] = sum(values) // len(values)
+		return result
+
+	def testModes(self):
+		random = numpy.random.RandomState(0)
+		frames = random.randint(500, 1000, (12, 9, 13)).astype(numpy.uint16)
+		frames[random.rand(*frames.shape) < 0.3] = kinect.UNKNOWN_DEPTH
+		# Pixels never known, and known only once
+		frames[:, 0, 0] = kinect.UNKNOWN_DEPTH
+		frames[:, 1, 1] = kinect.UNKNOWN_DEPTH
+		frames[4, 1, 1] = 700
+		out = numpy.empty(frames.shape[1:], numpy.uint16)
+		for mode in ('min', 'median', 'mean'):
+			for window in (1, 2, 5):
+				depthFilter = kinect.TemporalFilter(frames.shape[1:], window, mode)
+				for i in range(len(frames)):
+					# The first frames are filtered before the window is full
+					depthFilter.add(frames[i], out)
+					expected = self.expected(frames[max(0, i + 1 - window):i + 1], mode)
+					self.assertTrue(numpy.array_equal(out, expected), (mode, window, i))
+
+	def testUnknownMode(self):
+		self.assertRaises(ValueError, kinect.TemporalFilter, (2, 2), 5, 'max')
+
+class FailingDevice(kinect.FakeDevice):
+	"""
+	Fake device failing after a few frames
+	"""
+	def __init__(self, frames):
+		kinect.FakeDevice.__init__(self, frameRate=0)
+		self.frames = frames
+
+	def read(self):
+		if self.frames == 0:
+			raise IOError(5, 'Input/output error')
+		self.frames-= 1
+		return kinect.FakeDevice.read(self)
+
+class AcquisitionTest(unittest.TestCase):
+	"""
+	The depth is read from a device in a background thread
+	"""
+	def readDepth(self, device, timeout=10):
+		"""
+		Reads the depth until it is updated, returns the Kinect
+		"""
+		sensor = kinect.Kinect(device)
+		self.addCleanup(sensor.stop)
+		end = time.time() + timeout
+		while not sensor.readDepth():
+			self.assertTrue(time.time() < end, 'no depth read')
+			time.sleep(0.01)
+		return sensor
+
+	def acquisitionThreads(self):
+		return [thread for thread in threading.enumerate() if isinstance(thread, kinect.DepthAcquisition)]
+
+	def testRead(self):
+		sensor = self.readDepth(kinect.FakeDevice(frameRate=0))
+		self.assertEqual(sensor.depth.shape, (480, 640))
+		self.assertEqual(sensor.depth.dtype, numpy.uint16)
+		self.assertEqual(len(self.acquisitionThreads()), 1)
+		sensor.stop()
+		self.assertEqual(self.acquisitionThreads(), [])
+
+	def testError(self):
+		sensor = self.readDepth(FailingDevice(3))
+		end = time.time() + 10
+		with self.assertRaises(kinect.Kinect.KinectError) as context:
+			while time.time() < end:
+				sensor.readDepth()
+				time.sleep(0.01)
+		self.assertIn('Input/output error', str(context.exception))
+
+if __name__ == '__main__':
+	unittest.main()
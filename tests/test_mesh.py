@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Tests of the meshes of height maps
+"""
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import mesh
+
+def sortedTriangles(triangles):
+	"""
+	Triangles as a sorted list, each one starting from its smallest vertex
+	(which keeps its orientation), to compare meshes made in another order
+	"""
+	result = []
+	for triangle in numpy.round(numpy.asarray(triangles, numpy.float64), 4).tolist():
+		first = triangle.index(min(triangle))
+		result.append(triangle[first:] + triangle[:first])
+	return sorted(result)
+
+class HeightmapTest(unittest.TestCase):
+	"""
+	Meshes of height maps made at once and by strips
+	"""
+	def heightmap(self, z):
+		height, width = z.shape
+		return (z, numpy.arange(width) * 0.5, -numpy.arange(height) * 0.5)
+
+	def testStrips(self):
+		random = numpy.random.RandomState(0)
+		for i in range(0, 10):
+			z, x, y = self.heightmap(random.randint(1, 4, random.randint(2, 30, 2)).astype(float))
+			for mergeFlat in (False, True):
+				whole = mesh.heightmapMesh(z, x, y, mergeFlat)
+				for stripRows in (1, 7, 64):
+					streamed = numpy.concatenate(list(mesh.heightmapTriangles(z, x, y, mergeFlat, stripRows)))
+					self.assertEqual(sortedTriangles(streamed), sortedTriangles(whole.triangleArray()), (z.shape, mergeFlat, stripRows))
+
+	def testSingleRowOrColumn(self):
+		for shape in ((1, 1), (1, 6), (6, 1)):
+			z, x, y = self.heightmap(numpy.arange(1, 1 + shape[0] * shape[1], dtype=float).reshape(shape))
+			grid = mesh.heightmapMesh(z, x, y)
+			for mergeFlat, maxError in ((True, None), (False, 0.5), (True, 0.5)):
+				self.assertEqual(len(mesh.heightmapMesh(z, x, y, mergeFlat, maxError)), len(grid))
+			for mergeFlat in (False, True):
+				streamed = numpy.concatenate(list(mesh.heightmapTriangles(z, x, y, mergeFlat)))
+				self.assertEqual(sortedTriangles(streamed), sortedTriangles(grid.triangleArray()), (shape, mergeFlat))
+
+if __name__ == '__main__':
+	unittest.main()
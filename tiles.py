@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+"""
+Shares an image array between the processes of a pool,
+which work on it by tiles of rows.
+The array is copied once in shared memory, which the processes
+inherit when they start, so that tiles are never sent to them.
+Memory-mapped arrays are not copied, the processes map the same file.
+Requires NumPy.
+"""
+import multiprocessing
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Array shared with the current pool process, see TilePool
+_sharedArray = None
+
+class TilePool:
+	"""
+	Pool of processes working on tiles of rows of an array
+	"""
+	def __init__(self, data, processes, tileRows=None):
+		"""
+		Shares data and starts processes processes.
+		By default, the rows are split in 4 tiles per process.
+		"""
+		self.shape = data.shape
+		self.processes = processes
+		self.tileRows = tileRows
+		if tileRows is None:
+			self.tileRows = -(-data.shape[0] // (4 * processes))
+		if isinstance(data, numpy.memmap) and data.filename is not None:
+			self.__pool = multiprocessing.Pool(processes, _attachFile, (data.filename, data.offset, data.shape, data.dtype.str))
+			return
+		shared = multiprocessing.RawArray('B', data.nbytes)
+		sharedArray(shared, data.shape, data.dtype.str)[...] = data
+		self.__pool = multiprocessing.Pool(processes, _attach, (shared, data.shape, data.dtype.str))
+
+	def map(self, function, first=0, last=None, *args):
+		"""
+		Calls function(tile, tileFirst, *args) in the processes for each
+		tile of rows of the shared array between first and last
+		(all the rows by default), tileFirst being the index of the
+		first row of the tile. Returns an iterator on the results,
+		in the order of the tiles.
+		function must be defined at module level.
+		"""
+		if last is None:
+			last = self.shape[0]
+		tasks = [(function, tileFirst, min(tileFirst + self.tileRows, last), args)
+			for tileFirst in range(first, last, self.tileRows)]
+		return self.__pool.imap(_runTile, tasks)
+
+	def close(self):
+		"""
+		Stops the processes
+		"""
+		self.__pool.close()
+		self.__pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is not None:
+			self.__pool.terminate()
+		self.close()
+
+def sharedArray(shared, shape, dtype):
+	"""
+	Returns a NumPy array using the memory of a multiprocessing RawArray
+	"""
+	return numpy.frombuffer(shared, numpy.dtype(dtype)).reshape(shape)
+
+def _attach(shared, shape, dtype):
+	"""
+	Initializes a pool process with the shared array
+	"""
+	global _sharedArray
+	_sharedArray = sharedArray(shared, shape, dtype)
+
+def _attachFile(filename, offset, shape, dtype):
+	"""
+	Initializes a pool process with an array mapped from a file
+	"""
+	global _sharedArray
+	_sharedArray = numpy.memmap(filename, numpy.dtype(dtype), 'r', offset, shape)
+
+def _runTile(task):
+	"""
+	Runs a task of TilePool.map in a pool process
+	"""
+	function, first, last, args = task
+	return function(_sharedArray[first:last], first, *args)